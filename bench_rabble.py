@@ -0,0 +1,245 @@
+#!/usr/bin/python
+
+import sys
+import os
+import gc
+import time
+import json
+import random
+import resource
+import subprocess
+import tempfile
+
+import rabble
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+class BenchmarkServer(object):
+	def __init__(self):
+		self.message_count = 0
+		self.byte_count = 0
+
+	def send_message(self, agent, message):
+		if isinstance(message, rabble.EncodedMessage):
+			data = message.encode('lines')
+		else:
+			data = rabble.encode_message(message, 'lines')
+		self.message_count += 1
+		self.byte_count += len(data)
+
+class Benchmark(object):
+	def __init__(self, name, function, setup=None):
+		self.name = name
+		self.function = function
+		self.setup = setup
+
+	def run(self, min_time):
+		if self.setup:
+			self.setup()
+		function = self.function
+		function()
+
+		count = 0
+		start_time = time.time()
+		elapsed = 0.0
+		batch = 1
+		while elapsed < min_time:
+			for i in xrange(batch):
+				function()
+			count += batch
+			batch *= 2
+			elapsed = time.time() - start_time
+
+		result = {'name': self.name, 'ops': count, 'seconds': elapsed,
+			'ops_per_sec': count / elapsed}
+		result.update(self.measure_allocations(min(count, 1000)))
+		return result
+
+	def measure_allocations(self, count):
+		function = self.function
+		if tracemalloc:
+			tracemalloc.start()
+			before, peak = tracemalloc.get_traced_memory()
+			for i in xrange(count):
+				function()
+			after, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			return {'alloc_peak_bytes': peak,
+				'alloc_net_bytes_per_op': (after - before) / float(count)}
+		gc.collect()
+		gc.disable()
+		try:
+			before = len(gc.get_objects())
+			for i in xrange(count):
+				function()
+			after = len(gc.get_objects())
+		finally:
+			gc.enable()
+		return {'gc_objects_per_op': (after - before) / float(count)}
+
+def synthetic_word_list(path, count, seed):
+	rng = random.Random(seed)
+	letters = ''.join(letter * frequency for letter, frequency in
+		sorted(rabble.ScrabbleGame.letter_frequencies.iteritems()) if letter != '_')
+	words = set()
+	while len(words) < count:
+		length = rng.randint(2, 15)
+		words.add(''.join(rng.choice(letters) for i in xrange(length)))
+	f = open(path, 'w')
+	try:
+		for word in words:
+			f.write(word + '\n')
+	finally:
+		f.close()
+
+def mid_game(word_list, seed, turns):
+	random.seed(seed)
+	game = rabble.ScrabbleGame(0, word_list)
+	players = [game.add_player(None), game.add_player(None)]
+	game.deal()
+	generator = rabble.MoveGenerator(word_list)
+	for turn in xrange(turns):
+		player = game.players[game.to_move]
+		best = generator.best_move(game.board, player.rack)
+		if best:
+			game.make_move(player, best[1])
+		else:
+			game.make_pass(player)
+		if game.is_over():
+			break
+	return game, generator
+
+def create_benchmarks(word_list_path, play_word_list):
+	benchmarks = []
+
+	short_message = 'move_made 0 8h quixotic 28'
+	long_message = 'words 0 "%s"' % ' '.join(list(play_word_list)[:1024])
+	benchmarks.append(Benchmark('explode_args_short',
+		lambda: rabble.explode_args(short_message)))
+	benchmarks.append(Benchmark('explode_args_long',
+		lambda: rabble.explode_args(long_message)))
+
+	benchmarks.append(Benchmark('parse_move',
+		lambda: rabble.parse_move('h8', 'quixotic')))
+
+	game, generator = mid_game(play_word_list, 1, 12)
+	player = game.players[game.to_move]
+	candidates = [move for score, move in generator.generate(game.board, player.rack)]
+	state = {'index': 0}
+	def make_and_undo_move():
+		move = candidates[state['index'] % len(candidates)]
+		state['index'] += 1
+		game.make_move(game.players[game.to_move], move)
+		game.undo_move()
+	def reject_move():
+		try:
+			game.make_move(game.players[game.to_move], rejected)
+		except rabble.ScrabbleGame.InvalidMove:
+			pass
+	rejected = rabble.parse_move('8a', 'zzzzzzz')
+	if candidates:
+		benchmarks.append(Benchmark('make_move_mid_game', make_and_undo_move))
+	benchmarks.append(Benchmark('make_move_rejected', reject_move))
+	benchmarks.append(Benchmark('score_moves_mid_game',
+		lambda: game.board.score_moves(candidates, player.rack)))
+
+	strategies = [rabble.GreedyStrategy(generator)] * 2
+	benchmarks.append(Benchmark('simulate_game_greedy',
+		lambda: rabble.simulate_game(play_word_list, strategies, 0)))
+
+	benchmarks.append(Benchmark('load_word_list',
+		lambda: rabble.load_word_list(word_list_path)))
+
+	full_word_list = rabble.load_word_list(word_list_path)
+	send_game = rabble.ScrabbleGame(1, full_word_list)
+	for mode in ('lines', 'bulk', 'zlib'):
+		def send(mode=mode):
+			full_word_list.encodings.clear()
+			send_game.send_word_list(None, BenchmarkServer(), mode)
+		benchmarks.append(Benchmark('send_word_list_%s' % mode, send))
+
+	return benchmarks
+
+def current_revision():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+			cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def print_comparison(results, baseline_path):
+	baseline = json.load(open(baseline_path))
+	previous = dict((x['name'], x) for x in baseline['results'])
+	print 'compared with %s (%s):' % (baseline_path, baseline.get('revision'))
+	for result in results:
+		old = previous.get(result['name'])
+		if old:
+			print '  %-28s %7.2fx' % (result['name'],
+				result['ops_per_sec'] / old['ops_per_sec'])
+
+def main(argv):
+	word_list_path = None
+	play_word_list_path = None
+	output_path = None
+	baseline_path = None
+	word_count = 280000
+	min_time = 1.0
+	names = []
+	args = argv[1:]
+	while args:
+		arg = args.pop(0)
+		if arg in ('-w', '--words'):
+			word_list_path = args.pop(0)
+		elif arg in ('-p', '--play-words'):
+			play_word_list_path = args.pop(0)
+		elif arg in ('-o', '--output'):
+			output_path = args.pop(0)
+		elif arg in ('-c', '--compare'):
+			baseline_path = args.pop(0)
+		elif arg in ('-t', '--time'):
+			min_time = float(args.pop(0))
+		elif arg in ('-n', '--word-count'):
+			word_count = int(args.pop(0))
+		else:
+			names.append(arg)
+
+	temporary_path = None
+	if not word_list_path:
+		handle, temporary_path = tempfile.mkstemp(suffix='.txt')
+		os.close(handle)
+		synthetic_word_list(temporary_path, word_count, 0)
+		word_list_path = temporary_path
+
+	try:
+		play_word_list = rabble.load_word_list(play_word_list_path or word_list_path)
+		results = []
+		for benchmark in create_benchmarks(word_list_path, play_word_list):
+			if names and benchmark.name not in names:
+				continue
+			result = benchmark.run(min_time)
+			results.append(result)
+			print '%-28s %12.1f ops/s' % (result['name'], result['ops_per_sec'])
+	finally:
+		if temporary_path:
+			os.remove(temporary_path)
+
+	report = {
+		'revision': current_revision(),
+		'python': sys.version.split()[0],
+		'time': time.time(),
+		'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		'results': results}
+	if output_path:
+		f = open(output_path, 'w')
+		try:
+			json.dump(report, f, indent=1, sort_keys=True)
+		finally:
+			f.close()
+	if baseline_path:
+		print_comparison(results, baseline_path)
+
+if __name__ == '__main__':
+	main(sys.argv)
@@ -4,29 +4,108 @@ import threading
 import sys
 import time
 import os
+import stat
 import subprocess
 import errno
 import re
-import copy
 import random
+import array
+import bisect
+import Queue
+import zlib
+import base64
+import collections
+import select
+import multiprocessing
+import struct
+import mmap
+import socket
+import fcntl
+import itertools
 
 class ExplodeError(Exception): pass
 
-explode_arg_re = re.compile(r'"(?:.*\\")*.*"|[a-zA-Z0-9_]+')
+explode_space_re = re.compile(r'\s*')
+explode_word_re = re.compile(r'[a-zA-Z0-9_]+')
 def explode_args(string):
-	arg_re = explode_arg_re
+	skip_space = explode_space_re.match
+	match_word = explode_word_re.match
 	args = []
-	while True:
-		string = string.lstrip()
-		if not string:
-			return args
-		m = arg_re.match(string)
+	length = len(string)
+	position = skip_space(string).end()
+	while position < length:
+		if string[position] == '"':
+			end = string.find('\n', position)
+			if end < 0:
+				end = length
+			close = string.rfind('"', position + 1, end)
+			if close >= 0:
+				args.append(string[position:close + 1].strip('"'))
+				position = skip_space(string, close + 1).end()
+				continue
+		m = match_word(string, position)
 		if not m:
 			raise ExplodeError()
-		args.append(string[m.start():m.end()].strip('"'))
-		string = string[m.end():]
+		args.append(m.group())
+		position = skip_space(string, m.end()).end()
+	return args
+
+def quote_arg(arg):
+	m = explode_word_re.match(arg)
+	if m and m.end() == len(arg):
+		return arg
+	return '"%s"' % arg
+
+encode_words_re = re.compile(r'(?:[a-zA-Z0-9_]+ )*[a-zA-Z0-9_]+\Z')
+def encode_line(args):
+	strings = map(str, args)
+	line = ' '.join(strings)
+	if line.count(' ') != len(strings) - 1 or not encode_words_re.match(line):
+		line = ' '.join([quote_arg(x) for x in strings])
+	return line + '\n'
+
+framing_modes = ('lines', 'length')
+frame_header = struct.Struct('>I')
+def encode_frame(args):
+	payload = '\0'.join([str(x) for x in args])
+	return frame_header.pack(len(payload)) + payload
+
+def encode_message(message, framing):
+	if framing == 'lines':
+		return encode_line(message)
+	return encode_frame(message)
+
+class EncodedMessage(object):
+	__slots__ = ('message', 'encodings')
+
+	def __init__(self, message):
+		self.message = message
+		self.encodings = {}
+
+	def encode(self, framing):
+		data = self.encodings.get(framing)
+		if data is None:
+			data = self.encodings[framing] = encode_message(self.message, framing)
+		return data
+
+def decode_frame(payload):
+	if not payload:
+		return []
+	return payload.split('\0')
+
+def read_frame(f):
+	header = f.read(frame_header.size)
+	if len(header) < frame_header.size:
+		return None
+	length, = frame_header.unpack(header)
+	payload = f.read(length)
+	if len(payload) < length:
+		return None
+	return decode_frame(payload)
 
 class ServerChannelMessage(object):
+	__slots__ = ('id', 'command', 'args')
+
 	def __init__(self, id, command, args):
 		self.id = id
 		self.command = command
@@ -34,31 +113,269 @@ class ServerChannelMessage(object):
 
 class ThreadMessageQueue(object):
 	def __init__(self):
-		self.items = []
-		self.lock = threading.Lock()
+		self.items = collections.deque()
+		self.condition = threading.Condition()
+		self.peak = 0
+
+	def __len__(self):
+		return len(self.items)
 
 	def append(self, message):
-		self.lock.acquire()
+		self.condition.acquire()
 		try:
+			self.wait_for_space(message)
 			self.items.append(message)
+			self.peak = max(self.peak, len(self.items))
+			self.condition.notify_all()
 		finally:
-			self.lock.release()
+			self.condition.release()
 
 	def pop(self):
-		self.lock.acquire()
-		message = None
+		self.condition.acquire()
 		try:
-			message = self.items.pop(0)
+			while not self.items:
+				self.condition.wait()
+			message = self.items.popleft()
+			self.removed([message])
+			self.condition.notify_all()
 		finally:
-			self.lock.release()
+			self.condition.release()
 		return message
 
+	def pop_all(self, timeout=None):
+		self.condition.acquire()
+		try:
+			if timeout is None:
+				while not self.items:
+					self.condition.wait()
+			elif not self.items:
+				self.condition.wait(timeout)
+			messages = list(self.items)
+			self.items.clear()
+			self.removed(messages)
+			self.condition.notify_all()
+		finally:
+			self.condition.release()
+		return messages
+
+	def wait_for_space(self, message):
+		pass
+
+	def removed(self, messages):
+		pass
+
 class ServerChannelMessageQueue(ThreadMessageQueue):
-	pass
+	def __init__(self, limit=0):
+		ThreadMessageQueue.__init__(self)
+		self.limit = limit
+		self.pending = {}
+
+	def wait_for_space(self, message):
+		if self.limit:
+			while self.pending.get(message.id, 0) >= self.limit:
+				self.condition.wait()
+		self.pending[message.id] = self.pending.get(message.id, 0) + 1
+
+	def removed(self, messages):
+		for message in messages:
+			count = self.pending[message.id] - 1
+			if count:
+				self.pending[message.id] = count
+			else:
+				del self.pending[message.id]
 
 class ServerChannelIO(object):
+	read_size = 65536
+	close_timeout = 5.0
+
 	def __init__(self):
-		pass
+		self.read_buffer = ''
+		self.read_offset = 0
+		self.framing = 'lines'
+		self.output = collections.deque()
+		self.output_size = 0
+		self.output_condition = threading.Condition()
+		self.write_buffer = ''
+		self.writer = None
+		self.closing = False
+
+	def send_message(self, message, limit=0):
+		self.output_condition.acquire()
+		try:
+			if limit and self.output_size >= limit:
+				return False
+			if isinstance(message, EncodedMessage):
+				data = message.encode(self.framing)
+			else:
+				data = encode_message(message, self.framing)
+			self.output.append(data)
+			self.output_size += len(data)
+		finally:
+			self.output_condition.release()
+		return True
+
+	def has_output(self):
+		return bool(self.output or self.write_buffer)
+
+	def discard_output(self):
+		self.output_condition.acquire()
+		try:
+			self.output.clear()
+			self.output_size = 0
+		finally:
+			self.output_condition.release()
+
+	def take_output(self):
+		data = ''.join(self.output)
+		self.output.clear()
+		self.output_size = 0
+		return data
+
+	def flush(self):
+		if self.writer:
+			self.output_condition.acquire()
+			try:
+				self.output_condition.notify()
+			finally:
+				self.output_condition.release()
+		else:
+			self.write_pending()
+
+	def write_pending(self):
+		if not self.write_buffer:
+			self.output_condition.acquire()
+			try:
+				self.write_buffer = self.take_output()
+			finally:
+				self.output_condition.release()
+		data = self.write_buffer
+		if data:
+			fd = self.write_fileno()
+			if fd is None:
+				self.write(data)
+				written = len(data)
+			else:
+				try:
+					written = os.write(fd, data)
+				except OSError, e:
+					if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+						written = 0
+					else:
+						written = len(data)
+			self.write_buffer = data[written:]
+
+	def write_fileno(self):
+		return None
+
+	def set_nonblocking(self):
+		fd = self.write_fileno()
+		if fd is not None:
+			flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+			fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+	def start_writer(self):
+		self.writer = threading.Thread(target=self.write_loop)
+		self.writer.setDaemon(True)
+		self.writer.start()
+
+	def write_loop(self):
+		while True:
+			self.output_condition.acquire()
+			try:
+				while not self.output and not self.closing:
+					self.output_condition.wait()
+				if not self.output:
+					break
+				data = self.take_output()
+			finally:
+				self.output_condition.release()
+			self.write(data)
+
+	def close_output(self, discard=False, deadline=None):
+		self.output_condition.acquire()
+		try:
+			if discard:
+				self.output.clear()
+				self.output_size = 0
+				self.write_buffer = ''
+			self.closing = True
+			self.output_condition.notify()
+		finally:
+			self.output_condition.release()
+		if discard:
+			return
+		if deadline is None:
+			deadline = time.time() + self.close_timeout
+		if self.writer:
+			self.writer.join(max(0.0, deadline - time.time()))
+			return
+		fd = self.write_fileno()
+		self.write_pending()
+		while self.has_output() and time.time() < deadline:
+			if fd is not None:
+				try:
+					select.select([], [fd], [], deadline - time.time())
+				except (select.error, IOError, OSError), e:
+					if e.args[0] != errno.EINTR:
+						break
+			self.write_pending()
+
+	def set_framing(self, framing):
+		self.output_condition.acquire()
+		try:
+			self.framing = framing
+		finally:
+			self.output_condition.release()
+
+	def read_message(self):
+		try:
+			if self.framing == 'lines':
+				message = self.reader.readline() or None
+			else:
+				message = read_frame(self.reader)
+		except (IOError, socket.error):
+			message = None
+		if message is None:
+			self.eof = True
+			return ''
+		return message
+
+	def read_available(self):
+		data = os.read(self.fileno(), self.read_size)
+		if data:
+			self.read_buffer += data
+		else:
+			self.eof = True
+		return self.buffered_messages()
+
+	def buffered_messages(self):
+		while True:
+			message = self.next_buffered_message()
+			if message is None:
+				break
+			yield message
+		self.read_buffer = self.read_buffer[self.read_offset:]
+		self.read_offset = 0
+		if self.eof and self.read_buffer and self.framing == 'lines':
+			message, self.read_buffer = self.read_buffer, ''
+			yield message
+
+	def next_buffered_message(self):
+		buffer, offset = self.read_buffer, self.read_offset
+		if self.framing == 'lines':
+			index = buffer.find('\n', offset)
+			if index < 0:
+				return None
+			self.read_offset = index + 1
+			return buffer[offset:index]
+		start = offset + frame_header.size
+		if len(buffer) < start:
+			return None
+		length, = frame_header.unpack_from(buffer, offset)
+		if len(buffer) < start + length:
+			return None
+		self.read_offset = start + length
+		return decode_frame(buffer[start:start + length])
 
 class ServerChannel(object):
 	def __init__(self, id, io, agent, master_channel=False):
@@ -66,60 +383,115 @@ class ServerChannel(object):
 		self.io = io
 		self.agent = agent
 		self.master_channel = master_channel
+		self.messages_in = 0
+		self.messages_out = 0
+
+	def send_message(self, message, limit=0):
+		queued = self.io.send_message(message, limit)
+		if queued:
+			self.messages_out += 1
+		return queued
 
-	def send_message(self, message):
-		self.io.send_message(message)
+	def flush(self):
+		self.io.flush()
 
 	def listen(self, on_message, on_finished):
 		try:
 			while not self.io.is_end():
 				message = self.io.read_message()
-				if message:
-					args = None
-					error_message = None
-					try:
-						args = explode_args(message)
-					except ExplodeError:
-						error_message = 'invalid_syntax'
-					if error_message:
-						self.send_message('error %s' % error_message)
-
-					if args:
-						command, args = args[0], args[1:]
-						if command == 'exit':
-							break
-						elif command == 'debug':
-							if len(args) >= 1:
-								print '%d: %s' % (self.id, args[0])
-						on_message(self.id, command, args)
+				if not self.handle_line(message, on_message):
+					break
 		finally:
 			print 'channel ended'
 			on_finished(self.id)
 
-	def close(self):
-		self.io.close()
+	def handle_line(self, message, on_message):
+		if message:
+			args = None
+			error_message = None
+			if isinstance(message, list):
+				args = message
+			else:
+				try:
+					args = explode_args(message)
+				except ExplodeError:
+					error_message = 'invalid_syntax'
+			if error_message:
+				self.send_message(('error', error_message))
+				self.flush()
+
+			if args:
+				self.messages_in += 1
+				command, args = args[0], args[1:]
+				handler = self.control_handlers.get(command)
+				forward = True
+				if handler:
+					forward = handler(self, args)
+					if forward is False:
+						return False
+				if forward:
+					on_message(self.id, command, args)
+		return True
+
+	def control_exit(self, args):
+		return False
+
+	def control_debug(self, args):
+		if len(args) >= 1:
+			print '%d: %s' % (self.id, args[0])
+		return True
+
+	def control_framing(self, args):
+		if len(args) == 1 and args[0] in framing_modes:
+			self.send_message(('framing', args[0]))
+			self.io.set_framing(args[0])
+		else:
+			self.send_message(('error', 'invalid_framing'))
+		self.flush()
+		return None
+
+	control_handlers = {
+		'exit': control_exit,
+		'debug': control_debug,
+		'framing': control_framing}
+
+	def close(self, discard=False, deadline=None):
+		self.io.close_output(discard, deadline)
+		self.io.close(discard)
 
 	def cleanup(self):
 		self.io.cleanup()
 
 class Server(object):
-	def __init__(self, model):
+	tick_interval = 0.1
+	close_timeout = 5.0
+	command_timing_limit = 64
+	slow_consumer_policies = ('snapshot', 'kick')
+
+	def __init__(self, model, queue_limit=0, send_limit=1 << 20,
+			slow_consumer_policy='snapshot'):
 		self.channels = {}
 		self.model = model
-		self.message_semaphore = threading.Semaphore(0)
-		self.message_queue = ServerChannelMessageQueue()
+		self.message_queue = ServerChannelMessageQueue(queue_limit)
+		self.pending_flush = set()
+		self.overflowed = set()
+		self.send_limit = send_limit
+		self.slow_consumer_policy = slow_consumer_policy
 		self.finished = False
+		self.start_time = time.time()
+		self.command_timings = {}
+		self.stats_sources = []
 
 	def add_channel(self, channel):
 		self.channels[channel.id] = channel
+		if channel.io.write_fileno() is not None:
+			channel.io.start_writer()
 
 	def listen_to_channel(self, channel_id):
 		def channel_finished(id):
 			self.message_queue.append(ServerChannelMessage(id, None, None))
-			self.message_semaphore.release()
 		def message_received(id, command, args):
 			self.message_queue.append(ServerChannelMessage(id, command, args))
-			self.message_semaphore.release()
 
 		channel = self.channels[channel_id]
 		channel.listen(message_received, channel_finished)
@@ -129,54 +501,283 @@ class Server(object):
 		class Thread(threading.Thread):
 			def run(self):
 				while not server.finished:
-					server.message_semaphore.acquire()
-					message = server.message_queue.pop()
-					if not message.command:
-						server.cleanup_channel(message.id)
-					else:
-						server.handle_message(message.id, message.command, message.args)
-				for channel in server.channels.itervalues():
-					channel.close()
+					for message in server.message_queue.pop_all(server.tick_interval):
+						if not message.command:
+							server.cleanup_channel(message.id)
+						else:
+							server.handle_message(message.id, message.command, message.args)
+						if server.finished:
+							break
+					server.tick()
+				server.close_channels()
 				print 'server thread exitting'
 		thread = Thread()
 		thread.start()
 
 	def handle_message(self, id, command, args):
 		channel = self.channels[id]
+		started = time.time()
 		self.model.handle_message(channel.agent, command, args, self)
+		self.record_command(command, time.time() - started)
+		self.flush()
+
+	def record_command(self, command, elapsed):
+		timings = self.command_timings.get(command)
+		if timings is None:
+			if (len(self.command_timings) >= self.command_timing_limit or
+					not agent_name_re.match(command)):
+				command = 'other'
+			timings = self.command_timings.setdefault(command, LatencyHistogram())
+		timings.record(elapsed)
+
+	def stats_messages(self):
+		messages = [('stats_server', int((time.time() - self.start_time) * 1000),
+			len(self.channels), len(self.message_queue), self.message_queue.peak)]
+		for id, channel in sorted(self.channels.iteritems()):
+			messages.append(('stats_channel', id, channel.agent.id,
+				channel.messages_in, channel.messages_out,
+				channel.io.output_size + len(channel.io.write_buffer)))
+		for command, timings in sorted(self.command_timings.iteritems()):
+			messages.append(('stats_command', command) + timings.summary())
+		messages.extend(self.model.stats_messages())
+		for source in self.stats_sources:
+			messages.extend(source.stats_messages())
+		return messages
+
+	def tick(self):
+		self.model.handle_tick(self)
+		self.flush()
+
+	def flush(self):
+		if self.overflowed:
+			self.handle_overflow()
+		channels, self.pending_flush = self.pending_flush, set()
+		for channel in channels:
+			self.flush_channel(channel)
+
+	def flush_channel(self, channel):
+		channel.flush()
+
+	def handle_overflow(self):
+		channels, self.overflowed = self.overflowed, set()
+		for channel in channels:
+			if self.channels.get(channel.id) is not channel or channel.io.closing:
+				continue
+			message = None
+			if self.slow_consumer_policy == 'snapshot':
+				message = self.model.snapshot_message(channel.agent)
+			if message:
+				channel.io.discard_output()
+				channel.send_message(message)
+			else:
+				print 'channel %d fell behind' % channel.id
+				self.kick(channel.agent)
 
 	def cleanup_channel(self, id):
 		channel = self.channels[id]
 		del self.channels[id]
+		self.pending_flush.discard(channel)
 		channel.cleanup()
 		self.model.handle_disconnect(channel.agent, self)
+		self.flush()
 		num_master_channels = len([x for x in self.channels.itervalues()
 			if x.master_channel])
 		if num_master_channels == 0:
 			self.finished = True
 
+	def remove_channel(self, id, discard=False):
+		channel = self.channels.pop(id)
+		self.pending_flush.discard(channel)
+		channel.close(discard)
+		self.model.agents.pop(channel.agent.id, None)
+
 	def send_message(self, agent, message):
 		channel = self.channels[agent.channel_id]
 		channel.send_message(message)
+		self.pending_flush.add(channel)
+
+	def broadcast(self, agents, message):
+		message = EncodedMessage(message)
+		for agent in agents:
+			channel = self.channels[agent.channel_id]
+			limit = 0 if agent.player_indices else self.send_limit
+			if not channel.send_message(message, limit):
+				self.overflowed.add(channel)
+			self.pending_flush.add(channel)
 
 	def kick(self, agent):
 		print 'kicking agent %d' % agent.id
 		channel = self.channels[agent.channel_id]
-		channel.close()
+		channel.close(True)
+
+	def close_channels(self):
+		deadline = time.time() + self.close_timeout
+		for channel in self.channels.values():
+			channel.close(deadline=deadline)
+
+class EventLoopServer(Server):
+	def __init__(self, model, queue_limit=0, send_limit=1 << 20,
+			slow_consumer_policy='snapshot'):
+		Server.__init__(self, model, queue_limit, send_limit, slow_consumer_policy)
+		self.listeners = {}
+		self.readers = {}
+		self.writers = {}
+		self.channel_fds = {}
+		self.poll_masks = {}
+		self.poller = select.poll() if hasattr(select, 'poll') else None
+
+	def start(self):
+		pass
+
+	def listen_to_channel(self, channel_id):
+		pass
+
+	def add_channel(self, channel):
+		self.channels[channel.id] = channel
+		channel.io.set_nonblocking()
+		fds = (channel.io.fileno(), channel.io.write_fileno())
+		self.channel_fds[channel.id] = fds
+		self.readers[fds[0]] = channel
+		self.update_poll(fds[0])
+
+	def forget_channel(self, id):
+		for fd in self.channel_fds.pop(id, ()):
+			if fd is None:
+				continue
+			self.readers.pop(fd, None)
+			self.writers.pop(fd, None)
+			self.update_poll(fd)
+
+	def cleanup_channel(self, id):
+		self.forget_channel(id)
+		Server.cleanup_channel(self, id)
+
+	def remove_channel(self, id, discard=False):
+		self.forget_channel(id)
+		Server.remove_channel(self, id, discard)
+
+	def kick(self, agent):
+		Server.kick(self, agent)
+		self.cleanup_channel(agent.channel_id)
+
+	def add_listener(self, listener, on_accept):
+		self.listeners[listener] = on_accept
+		self.readers[listener.fileno()] = listener
+		self.update_poll(listener.fileno())
+
+	def flush_channel(self, channel):
+		channel.flush()
+		fd = channel.io.write_fileno()
+		if fd is None or self.channels.get(channel.id) is not channel:
+			return
+		pending = channel.io.has_output()
+		if pending != (fd in self.writers):
+			if pending:
+				self.writers[fd] = channel
+			else:
+				del self.writers[fd]
+			self.update_poll(fd)
+
+	def update_poll(self, fd):
+		if not self.poller:
+			return
+		mask = ((select.POLLIN if fd in self.readers else 0) |
+			(select.POLLOUT if fd in self.writers else 0))
+		registered = self.poll_masks.get(fd, 0)
+		if mask == registered:
+			return
+		if not mask:
+			del self.poll_masks[fd]
+			self.poller.unregister(fd)
+		else:
+			self.poll_masks[fd] = mask
+			if not registered:
+				self.poller.register(fd, mask)
+			else:
+				self.poller.modify(fd, mask)
+
+	def run(self, until=None):
+		while not self.finished and not (until and until()):
+			self.run_once()
+		self.close_channels()
+		print 'server loop exitting'
+
+	def close_channels(self):
+		for fd in self.readers.keys():
+			del self.readers[fd]
+			self.update_poll(fd)
+		deadline = time.time() + self.close_timeout
+		self.flush()
+		while self.writers and time.time() < deadline:
+			readable, writable = self.wait_ready()
+			for channel in writable:
+				self.flush_channel(channel)
+		for channel in self.channels.values():
+			channel.close(True)
+
+	def run_once(self):
+		readable, writable = self.wait_ready()
+		for channel in writable:
+			if self.channels.get(channel.id) is channel:
+				self.flush_channel(channel)
+		for source in readable:
+			if source in self.listeners:
+				self.accept(source)
+			elif self.channels.get(source.id) is source:
+				self.read_channel(source)
+		self.tick()
+
+	def accept(self, listener):
+		try:
+			io = listener.accept()
+		except socket.error, e:
+			print 'unable to accept connection: %s' % e
+			return
+		self.listeners[listener](io)
+
+	def read_channel(self, channel):
+		ended = False
+		for message in channel.io.read_available():
+			if not channel.handle_line(message, self.handle_message):
+				ended = True
+				break
+			if channel.id not in self.channels:
+				return
+		if channel.io.has_output():
+			self.flush_channel(channel)
+		if ended or channel.io.is_end():
+			print 'channel ended'
+			self.cleanup_channel(channel.id)
+
+	def wait_ready(self):
+		readers, writers = self.readers, self.writers
+		try:
+			if self.poller:
+				events = self.poller.poll(self.tick_interval * 1000)
+				return ([readers[fd] for fd, event in events
+						if fd in readers and event & ~select.POLLOUT],
+					[writers[fd] for fd, event in events
+						if fd in writers and event & ~select.POLLIN])
+			readable, writable, errors = select.select(readers.keys(), writers.keys(), [],
+				self.tick_interval)
+			return [readers[fd] for fd in readable], [writers[fd] for fd in writable]
+		except (select.error, IOError, OSError), e:
+			if e.args[0] == errno.EINTR:
+				return [], []
+			raise
 
 class StdServerChannelIO(ServerChannelIO):
 	def __init__(self):
 		ServerChannelIO.__init__(self)
 		self.eof = False
+		self.reader = sys.stdin
 
-	def read_message(self):
-		message = sys.stdin.readline()
-		if not message:
-			self.eof = True
-		return message
+	def write(self, data):
+		sys.stdout.write(data)
+		sys.stdout.flush()
 
-	def send_message(self, message):
-		sys.stdout.write(message + '\n')
+	def fileno(self):
+		return sys.stdin.fileno()
 
 	def is_end(self):
 		return self.eof
@@ -184,7 +785,7 @@ class StdServerChannelIO(ServerChannelIO):
 	def cleanup(self):
 		pass
 
-	def close(self):
+	def close(self, discard=False):
 		pass
 
 def create_std_server_channel(id, model):
@@ -195,34 +796,54 @@ def create_std_server_channel(id, model):
 	return channel
 
 class ChildProcessServerChannelIO(ServerChannelIO):
+	exit_timeout = 2.0
+
 	def __init__(self, cmd):
 		self.eof = False
 		ServerChannelIO.__init__(self)
 		self.process = subprocess.Popen([cmd], shell=True, bufsize=1,
 			stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		self.reader = self.process.stdout
 		print 'process =', self.process.pid
 
-	def read_message(self):
-		message = self.process.stdout.readline()
-		if not message:
-			self.eof = True
-		return message
-
-	def send_message(self, message):
+	def write(self, data):
 		try:
-			self.process.stdin.write(message + '\n')
-		except ValueError:
+			fd = self.process.stdin.fileno()
+			while data:
+				data = data[os.write(fd, data):]
+		except (ValueError, OSError):
 			pass
 
+	def fileno(self):
+		return self.process.stdout.fileno()
+
+	def write_fileno(self):
+		return self.process.stdin.fileno()
+
 	def is_end(self):
 		return self.eof
 
 	def cleanup(self):
 		self.process.stdin.close()
 
-	def close(self):
+	def kill(self):
+		try:
+			self.process.kill()
+		except OSError:
+			pass
+
+	def close(self, discard=False):
 		self.process.stdin.close()
-		print 'waiting for engine process (pid=%d) to exit...' % self.process.pid
+		if discard:
+			self.kill()
+		else:
+			print 'waiting for engine process (pid=%d) to exit...' % self.process.pid
+			deadline = time.time() + self.exit_timeout
+			while self.process.poll() is None and time.time() < deadline:
+				time.sleep(0.01)
+			if self.process.returncode is None:
+				print 'engine process (pid=%d) did not exit, killing it' % self.process.pid
+				self.kill()
 		retcode = self.process.wait()
 		print 'process exitted with return code %d' % retcode
 
@@ -233,11 +854,97 @@ def create_child_process_server_channel(id, model, cmd):
 	channel = ServerChannel(id, io, agent)
 	return channel
 
+class SocketServerChannelIO(ServerChannelIO):
+	def __init__(self, sock):
+		ServerChannelIO.__init__(self)
+		self.eof = False
+		self.socket = sock
+		self.reader = sock.makefile('r')
+
+	def write(self, data):
+		try:
+			self.socket.sendall(data)
+		except socket.error:
+			pass
+
+	def fileno(self):
+		return self.socket.fileno()
+
+	def write_fileno(self):
+		return self.socket.fileno()
+
+	def is_end(self):
+		return self.eof
+
+	def cleanup(self):
+		self.close()
+
+	def close(self, discard=False):
+		try:
+			self.socket.shutdown(socket.SHUT_RDWR)
+		except socket.error:
+			pass
+		self.reader.close()
+		self.socket.close()
+
+def parse_socket_address(address):
+	if address.startswith('unix:'):
+		return socket.AF_UNIX, address[len('unix:'):]
+	host, separator, port = address.rpartition(':')
+	return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+def connect_socket(address):
+	family, target = parse_socket_address(address)
+	sock = socket.socket(family, socket.SOCK_STREAM)
+	sock.connect(target)
+	return sock
+
+class ServerChannelListener(object):
+	backlog = 16
+
+	def __init__(self, address):
+		family, target = parse_socket_address(address)
+		self.path = None
+		if family == socket.AF_UNIX:
+			if os.path.exists(target):
+				if not stat.S_ISSOCK(os.stat(target).st_mode):
+					raise socket.error(errno.EADDRINUSE, 'not a socket: %s' % target)
+				os.remove(target)
+			self.path = target
+		self.socket = socket.socket(family, socket.SOCK_STREAM)
+		if family != socket.AF_UNIX:
+			self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.socket.bind(target)
+		self.socket.listen(self.backlog)
+
+	def fileno(self):
+		return self.socket.fileno()
+
+	def accept(self):
+		sock, address = self.socket.accept()
+		return SocketServerChannelIO(sock)
+
+	def close(self):
+		self.socket.close()
+		if self.path and os.path.exists(self.path):
+			os.remove(self.path)
+
+def create_socket_server_channel(id, model, io):
+	privileges = GameServerAgentPrivileges()
+	agent = model.create_agent(id, privileges)
+	channel = ServerChannel(id, io, agent)
+	return channel
+
 class GameServerAgentPrivileges(object):
 	def __init__(self, admin_privs=False):
 		self.admin_privs = admin_privs
 
+agent_name_re = re.compile(r'^[a-zA-Z0-9_]+$')
+
 class GameServerAgent(object):
+	__slots__ = ('id', 'channel_id', 'name', 'game', 'player_indices', 'privileges',
+		'ready')
+
 	def __init__(self, id, channel_id, privileges):
 		self.id = id
 		self.channel_id = channel_id
@@ -245,6 +952,7 @@ class GameServerAgent(object):
 		self.game = None
 		self.player_indices = set()
 		self.privileges = privileges
+		self.ready = True
 
 	def set_game(self, game):
 		self.game = game
@@ -253,26 +961,73 @@ class GameServerAgent(object):
 		self.player_indices.add(player_index)
 
 	def handle_message(self, command, args, model, server):
-		if command == 'kick':
-			if self.privileges.admin_privs:
-				try:
-					agent_string, = args
-					agent_id = int(agent_string)
-					agent = model.agents[agent_id]
-				except:
-					agent = None
-				if agent:
-					server.kick(agent)
-				else:
-					server.send_message(self, 'error invalid_user')
+		handler = self.command_handlers.get(command)
+		if handler:
+			handler(self, args, model, server)
+		elif self.game:
+			self.game.handle_message(command, args, self, server)
+		else:
+			server.send_message(self, ('error', 'no_game_selected', command))
 
+	def command_kick(self, args, model, server):
+		if self.privileges.admin_privs:
+			try:
+				agent_string, = args
+				agent_id = int(agent_string)
+				agent = model.agents[agent_id]
+			except:
+				agent = None
+			if agent:
+				server.kick(agent)
 			else:
-				server.send_message(self, 'error permission_denied %s' % command)
+				server.send_message(self, ('error', 'invalid_user'))
+
 		else:
-			if self.game:
-				self.game.handle_message(command, args, self, server)
-			else:
-				server.send_message(self, 'error no_game_selected %s' % command)
+			server.send_message(self, ('error', 'permission_denied', 'kick'))
+
+	def command_ready(self, args, model, server):
+		self.ready = True
+
+	def command_stats(self, args, model, server):
+		if self.privileges.admin_privs:
+			messages = server.stats_messages()
+			server.send_message(self, ('stats_count', len(messages)))
+			for message in messages:
+				server.send_message(self, message)
+		else:
+			server.send_message(self, ('error', 'permission_denied', 'stats'))
+
+	def command_set_name(self, args, model, server):
+		if len(args) == 1 and agent_name_re.match(args[0]):
+			self.set_name(args[0])
+		else:
+			server.send_message(self, ('error', 'invalid_name'))
+
+	def command_watch(self, args, model, server):
+		try:
+			game_string, = args
+			game = model.games[int(game_string)]
+		except (ValueError, KeyError):
+			game = None
+		if self.game:
+			server.send_message(self, ('error', 'already_in_game'))
+		elif not game:
+			server.send_message(self, ('error', 'invalid_game'))
+		else:
+			self.set_game(game)
+			game.add_watcher(self)
+			server.send_message(self, ('watching', game.id))
+			if game.to_move >= 0:
+				server.send_message(self, game.encode_state())
+
+	def command_unwatch(self, args, model, server):
+		if not self.game or self.player_indices:
+			server.send_message(self, ('error', 'not_watching'))
+		else:
+			game = self.game
+			game.remove_watcher(self)
+			self.set_game(None)
+			server.send_message(self, ('unwatched', game.id))
 
 	def handle_disconnect(self, model, server):
 		if self.game:
@@ -281,6 +1036,14 @@ class GameServerAgent(object):
 	def set_name(self, name):
 		self.name = name
 
+	command_handlers = {
+		'kick': command_kick,
+		'ready': command_ready,
+		'set_name': command_set_name,
+		'stats': command_stats,
+		'unwatch': command_unwatch,
+		'watch': command_watch}
+
 class GameServerModel(object):
 	def __init__(self, game_factory):
 		self.game_factory = game_factory
@@ -302,6 +1065,10 @@ class GameServerModel(object):
 		agent.handle_disconnect(self, server)
 		del self.agents[agent.id]
 
+	def handle_tick(self, server):
+		for game in self.games.values():
+			game.handle_tick(server)
+
 	def create_game(self):
 		id = self.alloc_game_id()
 		game = self.game_factory(id)
@@ -311,6 +1078,22 @@ class GameServerModel(object):
 	def start_game(self, game, server):
 		game.start(server)
 
+	def remove_game(self, game):
+		del self.games[game.id]
+		for agent in game.agents:
+			if agent.game is game:
+				agent.set_game(None)
+
+	def stats_messages(self):
+		return [game.stats_message() for id, game in sorted(self.games.iteritems())]
+
+	def snapshot_message(self, agent):
+		game = agent.game
+		if game and game.to_move >= 0:
+			player_index = min(agent.player_indices) if agent.player_indices else None
+			return game.encode_state(player_index)
+		return None
+
 	def alloc_agent_id(self):
 		id, self.last_agent_id = self.last_agent_id, self.last_agent_id + 1
 		return id
@@ -319,33 +1102,292 @@ class GameServerModel(object):
 		id, self.last_game_id = self.last_game_id, self.last_game_id + 1
 		return id
 
+class LatencyHistogram(object):
+	bucket_limits = [0.001 * 2 ** i for i in xrange(20)]
+
+	def __init__(self):
+		self.counts = [0] * (len(self.bucket_limits) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.maximum = 0.0
+
+	def record(self, seconds):
+		self.counts[bisect.bisect_left(self.bucket_limits, seconds)] += 1
+		self.count += 1
+		self.total += seconds
+		self.maximum = max(self.maximum, seconds)
+
+	def merge(self, other):
+		for index, count in enumerate(other.counts):
+			self.counts[index] += count
+		self.count += other.count
+		self.total += other.total
+		self.maximum = max(self.maximum, other.maximum)
+
+	def percentile(self, fraction):
+		target = fraction * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if count and seen >= target:
+				if index < len(self.bucket_limits):
+					return min(self.bucket_limits[index], self.maximum)
+				break
+		return self.maximum
+
+	def mean(self):
+		return self.total / self.count if self.count else 0.0
+
+	def summary(self):
+		return (self.count, int(self.mean() * 1e6), int(self.percentile(0.5) * 1e6),
+			int(self.percentile(0.9) * 1e6), int(self.percentile(0.99) * 1e6),
+			int(self.maximum * 1e6))
+
+profiler_state = {}
+
+class SamplingProfiler(object):
+	def __init__(self, path, interval=0.01, save_interval=0):
+		self.path = path
+		self.interval = interval
+		self.save_interval = save_interval
+		self.stacks = {}
+		self.samples = 0
+		self.running = False
+		self.thread = None
+		self.pid = None
+
+	def start(self):
+		self.remove_worker_profiles()
+		self.pid = os.getpid()
+		self.running = True
+		self.thread = threading.Thread(target=self.run)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def run(self):
+		own_id = threading.current_thread().ident
+		saved = time.time()
+		while self.running:
+			for thread_id, frame in sys._current_frames().items():
+				if thread_id != own_id:
+					self.sample(frame)
+			self.samples += 1
+			if self.save_interval and time.time() - saved >= self.save_interval:
+				self.save()
+				saved = time.time()
+			time.sleep(self.interval)
+
+	def sample(self, frame):
+		names = []
+		while frame is not None:
+			code = frame.f_code
+			names.append('%s:%d:%s' % (os.path.basename(code.co_filename),
+				code.co_firstlineno, code.co_name))
+			frame = frame.f_back
+		names.reverse()
+		key = ';'.join(names)
+		self.stacks[key] = self.stacks.get(key, 0) + 1
+
+	def stop(self):
+		self.running = False
+		if self.thread:
+			self.thread.join()
+		self.dump()
+
+	def worker_profile_paths(self):
+		directory, prefix = os.path.split(self.path + '.worker.')
+		try:
+			names = os.listdir(directory or '.')
+		except OSError:
+			return []
+		return [os.path.join(directory, name) for name in names
+			if name.startswith(prefix) and name[len(prefix):].isdigit()]
+
+	def remove_worker_profiles(self):
+		for path in self.worker_profile_paths():
+			os.remove(path)
+
+	def merge_worker_profiles(self):
+		paths = self.worker_profile_paths()
+		for path in paths:
+			f = open(path)
+			try:
+				for line in f:
+					stack, count = line.rsplit(' ', 1)
+					self.stacks[stack] = self.stacks.get(stack, 0) + int(count)
+			finally:
+				f.close()
+			os.remove(path)
+		return len(paths)
+
+	def save(self):
+		stacks = sorted(self.stacks.iteritems(), key=lambda x: -x[1])
+		f = open(self.path + '.tmp', 'w')
+		try:
+			for stack, count in stacks:
+				f.write('%s %d\n' % (stack, count))
+		finally:
+			f.close()
+		os.rename(self.path + '.tmp', self.path)
+		return stacks
+
+	def dump(self):
+		workers = self.merge_worker_profiles()
+		stacks = self.save()
+		leaves = {}
+		for stack, count in stacks:
+			leaf = stack.rsplit(';', 1)[-1]
+			leaves[leaf] = leaves.get(leaf, 0) + count
+		total = max(sum(leaves.itervalues()), 1)
+		print 'profile: %d samples written to "%s"' % (self.samples, self.path)
+		if workers:
+			print 'profile: merged stacks from %d worker processes' % workers
+		for leaf, count in sorted(leaves.iteritems(), key=lambda x: -x[1])[:10]:
+			print '  %5.1f%% %s' % (100.0 * count / total, leaf)
+
+class GameClock(object):
+	def __init__(self, total, increment):
+		self.remaining = total
+		self.increment = increment
+
+	def charge(self, elapsed):
+		self.remaining = max(0, self.remaining - elapsed)
+		if self.remaining > 0:
+			self.remaining += self.increment
+
+	def expired(self, elapsed):
+		return self.remaining <= elapsed
+
+slot_tiles = [chr(ord('a') + i) for i in xrange(26)] + ['_']
+tile_slots = dict((tile, slot) for slot, tile in enumerate(slot_tiles))
+
+zobrist_random = random.Random(0x5c4abb1e)
+zobrist_mask = (1 << 64) - 1
+
+class TileCounts(object):
+	__slots__ = ('counts', 'total', 'hash')
+	zobrist_keys = [zobrist_random.getrandbits(64) for tile in slot_tiles]
+
+	def __init__(self, tiles=''):
+		counts = array.array('B', [0] * len(slot_tiles))
+		hash = 0
+		for tile in tiles:
+			slot = tile_slots[tile]
+			counts[slot] += 1
+			hash += self.zobrist_keys[slot]
+		self.counts = counts
+		self.total = len(tiles)
+		self.hash = hash & zobrist_mask
+
+	def __len__(self):
+		return self.total
+
+	def get(self, tile, default=0):
+		slot = tile_slots.get(tile)
+		if slot is None:
+			return default
+		return self.counts[slot]
+
+	def add(self, tile):
+		slot = tile_slots[tile]
+		self.counts[slot] += 1
+		self.total += 1
+		self.hash = (self.hash + self.zobrist_keys[slot]) & zobrist_mask
+
+	def remove(self, tile):
+		slot = tile_slots[tile]
+		if not self.counts[slot]:
+			raise KeyError(tile)
+		self.counts[slot] -= 1
+		self.total -= 1
+		self.hash = (self.hash - self.zobrist_keys[slot]) & zobrist_mask
+
+	def iteritems(self):
+		for slot, count in enumerate(self.counts):
+			if count:
+				yield slot_tiles[slot], count
+
+	def tiles(self):
+		return ''.join(tile * count for tile, count in self.iteritems())
+
+class TileBag(object):
+	__slots__ = ('order', 'counts')
+
+	def __init__(self, tiles=''):
+		self.order = bytearray(tiles)
+		self.counts = TileCounts(tiles)
+
+	def __len__(self):
+		return len(self.order)
+
+	def __str__(self):
+		return str(self.order)
+
+	def shuffle(self, rng=random):
+		rng.shuffle(self.order)
+
+	def draw(self):
+		if not self.order:
+			return None
+		tile = chr(self.order.pop())
+		self.counts.remove(tile)
+		return tile
+
+	def put_back(self, tile):
+		self.order.append(ord(tile))
+		self.counts.add(tile)
+
 class ScrabblePlayer(object):
+	__slots__ = ('index', 'agent', 'rack', 'score', 'clock', 'latency')
+
 	def __init__(self, index, agent):
 		self.index = index
 		self.agent = agent
-		self.rack = {}
+		self.rack = TileCounts()
 		self.score = 0
+		self.clock = None
+		self.latency = LatencyHistogram()
 
 class ScrabbleMove(object):
 	horizontal = 1
 	vertical = 2
+	__slots__ = ('start', 'direction', 'letters')
+
 	def __init__(self, start, direction, letters):
 		self.start = start
 		self.direction = direction
 		self.letters = letters
 
-	def __str__(self):
+	def fields(self):
 		row, col = self.start
 		if self.direction == self.horizontal:
-			pos_str = '%d%c' % (row, chr(ord('a') + col))
+			pos_str = '%d%c' % (row + 1, chr(ord('a') + col))
 		else:
-			pos_str = '%c%d' % (chr(ord('a') + col), row)
+			pos_str = '%c%d' % (chr(ord('a') + col), row + 1)
 		
 		word_str = ''
 		for letter in self.letters:
 			word_str += letter
 
-		return '%s %s' % (pos_str, word_str)
+		return pos_str, word_str
+
+	def __str__(self):
+		return '%s %s' % self.fields()
+
+class ScrabbleMoveDelta(object):
+	__slots__ = ('player_index', 'move', 'placed', 'rack_used', 'tiles_drawn', 'words',
+		'score', 'previous_to_move', 'board_hash')
+
+	def __init__(self, player_index, move):
+		self.player_index = player_index
+		self.move = move
+		self.placed = []
+		self.rack_used = []
+		self.tiles_drawn = []
+		self.words = []
+		self.score = 0
+		self.previous_to_move = -1
+		self.board_hash = 0
 
 class ParseMoveError(Exception):
 	pass
@@ -385,9 +1427,309 @@ def parse_move(position_string, letter_string):
 
 	return ScrabbleMove((row, col), direction, letters)
 
-class ScrabbleGame(object):
+letter_bits = dict((chr(ord('a') + i), 1 << i) for i in xrange(26))
+
+class ScrabbleBoard(object):
 	num_rows = 15
 	num_cols = 15
+	center_row = 7
+	center_col = 7
+	all_letters = (1 << 26) - 1
+	cross_check_cache_limit = 65536
+	neighbour_steps = ((1, 0), (-1, 0), (0, 1), (0, -1))
+	zobrist_keys = [zobrist_random.getrandbits(64) for i in xrange(num_rows * num_cols * 26)]
+
+	def __init__(self, lexicon, letter_scores):
+		self.lexicon = lexicon
+		self.letter_scores = letter_scores
+		size = self.num_rows * self.num_cols
+		self.cells = bytearray(size)
+		self.tile_count = 0
+		self.hash = 0
+		self.cross_masks = {}
+		self.cross_scores = {}
+		for direction in (ScrabbleMove.horizontal, ScrabbleMove.vertical):
+			self.cross_masks[direction] = array.array('i', [self.all_letters]) * size
+			self.cross_scores[direction] = array.array('h', [-1]) * size
+		self.anchors = bytearray(size)
+		self.anchors[self.center_row * self.num_cols + self.center_col] = True
+
+	def get(self, row, col):
+		cell = self.cells[row * self.num_cols + col]
+		if not cell:
+			return None
+		return chr(cell)
+
+	def is_empty(self):
+		return self.tile_count == 0
+
+	def is_anchor(self, row, col):
+		return self.anchors[row * self.num_cols + col]
+
+	def allows(self, direction, row, col, letter):
+		return bool(self.cross_masks[direction][row * self.num_cols + col] &
+			letter_bits[letter])
+
+	def cross_score(self, direction, row, col):
+		return self.cross_scores[direction][row * self.num_cols + col]
+
+	def place(self, tiles):
+		for row, col, letter in tiles:
+			index = row * self.num_cols + col
+			self.cells[index] = ord(letter)
+			self.hash ^= self.zobrist_keys[index * 26 + ord(letter) - ord('a')]
+		self.tile_count += len(tiles)
+		self.refresh(tiles)
+
+	def remove(self, tiles):
+		for row, col, letter in tiles:
+			index = row * self.num_cols + col
+			self.cells[index] = 0
+			self.hash ^= self.zobrist_keys[index * 26 + ord(letter) - ord('a')]
+		self.tile_count -= len(tiles)
+		self.refresh(tiles)
+
+	def refresh(self, tiles):
+		both = (ScrabbleMove.horizontal, ScrabbleMove.vertical)
+		affected = {}
+		for row, col, letter in tiles:
+			affected[(row, col)] = both
+		for row, col, letter in tiles:
+			for step_y, step_x in self.neighbour_steps:
+				y, x = row + step_y, col + step_x
+				while (0 <= y < self.num_rows and 0 <= x < self.num_cols and
+						self.cells[y * self.num_cols + x]):
+					y += step_y
+					x += step_x
+				if 0 <= y < self.num_rows and 0 <= x < self.num_cols:
+					if step_y:
+						direction = ScrabbleMove.horizontal
+					else:
+						direction = ScrabbleMove.vertical
+					directions = affected.get((y, x), ())
+					if direction not in directions:
+						affected[(y, x)] = directions + (direction,)
+		for (row, col), directions in affected.iteritems():
+			self.update_cell(row, col, directions)
+
+	def update_cell(self, row, col, directions=None):
+		index = row * self.num_cols + col
+		if self.cells[index]:
+			self.anchors[index] = False
+			return
+		if not self.tile_count:
+			self.anchors[index] = row == self.center_row and col == self.center_col
+		else:
+			self.anchors[index] = any(0 <= row + step_y < self.num_rows and
+				0 <= col + step_x < self.num_cols and
+				self.cells[(row + step_y) * self.num_cols + col + step_x]
+				for step_y, step_x in self.neighbour_steps)
+		for direction in directions or ScrabbleGame.direction_steps:
+			dir_x, dir_y = ScrabbleGame.direction_steps[direction]
+			mask, score = self.compute_cross_check(row, col, dir_y, dir_x)
+			self.cross_masks[direction][index] = mask
+			self.cross_scores[direction][index] = score
+
+	def compute_cross_check(self, row, col, step_x, step_y):
+		prefix = self.run_before(col, row, step_x, step_y)
+		suffix = self.run_after(col, row, step_x, step_y)
+		if not prefix and not suffix:
+			return self.all_letters, -1
+		key = (prefix, suffix)
+		cache = self.lexicon.cross_check_cache
+		if key in cache:
+			return cache[key]
+		mask = 0
+		lexicon = self.lexicon
+		node = lexicon.lookup(prefix)
+		if node >= 0:
+			for letter, child in lexicon.edges(node):
+				for x in suffix:
+					child = lexicon.child(child, x)
+					if child < 0:
+						break
+				if child >= 0 and lexicon.is_final(child):
+					mask |= letter_bits[letter]
+		score = 0
+		for letter in prefix + suffix:
+			score += self.letter_scores[letter]
+		if len(cache) >= self.cross_check_cache_limit:
+			cache.clear()
+		cache[key] = (mask, score)
+		return mask, score
+
+	def evaluate(self, move, rack=None):
+		row, col = move.start
+		dir_x, dir_y = ScrabbleGame.direction_steps[move.direction]
+		num_cols = self.num_cols
+		cells = self.cells
+		masks = self.cross_masks[move.direction]
+		cross_scores = self.cross_scores[move.direction]
+		letter_scores = self.letter_scores
+
+		score = 0
+		placed = []
+		needed = {}
+		connected = False
+		cross_words = 0
+		for letter_index, tile in enumerate(move.letters):
+			tile_x, tile_y = col + dir_x * letter_index, row + dir_y * letter_index
+			if tile_x < 0 or tile_x >= num_cols:
+				raise ScrabbleGame.InvalidMove()
+			if tile_y < 0 or tile_y >= self.num_rows:
+				raise ScrabbleGame.InvalidMove()
+			index = tile_y * num_cols + tile_x
+			current_tile = cells[index]
+			if not current_tile:
+				if not masks[index] & letter_bits[tile]:
+					raise ScrabbleGame.InvalidMove()
+				cross_score = cross_scores[index]
+				if cross_score >= 0:
+					score += cross_score + letter_scores[tile]
+					cross_words += 1
+				placed.append((tile_y, tile_x, tile))
+				needed[tile] = needed.get(tile, 0) + 1
+				if self.anchors[index]:
+					connected = True
+			elif current_tile != ord(tile):
+				raise ScrabbleGame.InvalidMove()
+			else:
+				connected = True
+		if not placed or not connected:
+			raise ScrabbleGame.InvalidMove()
+		if rack is not None:
+			for tile, count in needed.iteritems():
+				if rack.get(tile, 0) < count:
+					raise ScrabbleGame.InvalidMove()
+
+		end_x = col + dir_x * (len(move.letters) - 1)
+		end_y = row + dir_y * (len(move.letters) - 1)
+		main_word = (self.run_before(col, row, dir_x, dir_y) +
+			''.join(move.letters) + self.run_after(end_x, end_y, dir_x, dir_y))
+		if len(main_word) > 1:
+			if main_word not in self.lexicon:
+				raise ScrabbleGame.InvalidMove()
+			for letter in main_word:
+				score += letter_scores[letter]
+		elif not cross_words:
+			raise ScrabbleGame.InvalidMove()
+		return score, placed, main_word, cross_words
+
+	def score_moves(self, moves, rack=None):
+		scores = []
+		for move in moves:
+			try:
+				scores.append(self.evaluate(move, rack)[0])
+			except ScrabbleGame.InvalidMove:
+				scores.append(None)
+		return scores
+
+	def letters_from(self, x, y, step_x, step_y):
+		cells = self.cells
+		num_cols = self.num_cols
+		letters = bytearray()
+		while (0 <= x < num_cols and 0 <= y < self.num_rows and
+				cells[y * num_cols + x]):
+			letters.append(cells[y * num_cols + x])
+			x += step_x
+			y += step_y
+		return letters
+
+	def run_before(self, x, y, dir_x, dir_y):
+		letters = self.letters_from(x - dir_x, y - dir_y, -dir_x, -dir_y)
+		letters.reverse()
+		return str(letters)
+
+	def run_after(self, x, y, dir_x, dir_y):
+		return str(self.letters_from(x + dir_x, y + dir_y, dir_x, dir_y))
+
+	def word_at(self, x, y, dir_x, dir_y):
+		cells = self.cells
+		num_cols = self.num_cols
+		if (x < 0 or y < 0 or x >= num_cols or y >= self.num_rows or
+				not cells[y * num_cols + x]):
+			return ''
+		while (x - dir_x >= 0 and y - dir_y >= 0 and
+				cells[(y - dir_y) * num_cols + x - dir_x]):
+			x -= dir_x
+			y -= dir_y
+		letters = bytearray()
+		while x < num_cols and y < self.num_rows and cells[y * num_cols + x]:
+			letters.append(cells[y * num_cols + x])
+			x += dir_x
+			y += dir_y
+		return str(letters)
+
+class ScrabbleGameObserver(object):
+	def board_changed(self, game):
+		pass
+
+	def rack_shown(self, game, player):
+		pass
+
+	def word_formed(self, game, word):
+		pass
+
+	def close(self):
+		pass
+
+class NullGameObserver(ScrabbleGameObserver):
+	pass
+
+class ConsoleGameObserver(ScrabbleGameObserver):
+	def __init__(self, stream=None):
+		self.stream = stream or sys.stdout
+
+	def write(self, text):
+		self.stream.write(text)
+		self.stream.flush()
+
+	def board_changed(self, game):
+		columns = ''.join(chr(ord('a') + col) for col in xrange(game.num_cols))
+		border = '  +%s+\n' % ('-' * game.num_cols)
+		lines = ['   %s \n' % columns, border]
+		for row in xrange(game.num_rows):
+			tiles = ''.join(game.board.get(row, col) or '.' for col in xrange(game.num_cols))
+			lines.append('%2d|%s|\n' % (row + 1, tiles))
+		lines.append(border)
+		self.write(''.join(lines))
+
+	def rack_shown(self, game, player):
+		self.write(''.join('%c ' % tile for tile in player.rack.tiles()) + '\n')
+
+	def word_formed(self, game, word):
+		self.write(word + '\n')
+
+class FileGameObserver(ConsoleGameObserver):
+	def __init__(self, path):
+		ConsoleGameObserver.__init__(self, open(path, 'a'))
+		self.queue = Queue.Queue()
+		self.thread = threading.Thread(target=self.write_queued)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def write(self, text):
+		self.queue.put(text)
+
+	def write_queued(self):
+		while True:
+			text = self.queue.get()
+			if text is None:
+				break
+			self.stream.write(text)
+			if self.queue.empty():
+				self.stream.flush()
+
+	def close(self):
+		self.queue.put(None)
+		self.thread.join()
+		self.stream.close()
+
+class ScrabbleGame(object):
+	num_rows = ScrabbleBoard.num_rows
+	num_cols = ScrabbleBoard.num_cols
+	center_row = ScrabbleBoard.center_row
+	center_col = ScrabbleBoard.center_col
 	initial_tiles = 7
 	letter_scores = ({
 		'a': 1,
@@ -444,237 +1786,797 @@ class ScrabbleGame(object):
 		'y': 2,
 		'z': 1,
 		'_': 2})
+	direction_steps = ({
+		ScrabbleMove.horizontal: (1, 0),
+		ScrabbleMove.vertical: (0, 1)})
 
-	def __init__(self, id, word_list):
+	def __init__(self, id, word_list, observer=None, time_control=None, rng=random):
 		self.id = id
+		self.time_control = time_control
+		self.turn_started = None
+		self.forfeited = None
+		self.observer = observer or NullGameObserver()
 		self.players = []
 		self.agents = set()
 		self.to_move = -1
 		self.word_list = word_list
-		self.board = ([([None for x in xrange(self.num_cols)]) for y in xrange(self.num_rows)])
-		self.pool = sum(([x for i in xrange(n)] for x, n in self.letter_frequencies.iteritems()), [])
-		random.shuffle(self.pool)
+		self.move_history = []
+		self.initial_bag = ''
+		self.finished = False
+		self.version = 0
+		self.state_cache = None
+		self.moves_accepted = 0
+		self.moves_rejected = 0
+		self.move_timings = LatencyHistogram()
+		self.board = ScrabbleBoard(word_list, self.letter_scores)
+		self.pool = TileBag(''.join(x * n for x, n in self.letter_frequencies.iteritems()))
+		self.pool.shuffle(rng)
 
 	def handle_message(self, command, args, agent, server):
-		if command == 'move':
-			move = None
-			if len(args) == 2:
-				try:
-					position, word = args
-					move = parse_move(position, word)
-				except ParseMoveError:
-					pass
-			if move:
-				self.request_move(agent, server, move)
-			else:
-				server.send_message(agent, 'error move_syntax')
-		elif command == 'get_word_list':
+		handler = self.command_handlers.get(command)
+		if self.finished and command in self.game_over_commands:
+			server.send_message(agent, ('error', 'game_over'))
+		elif handler:
+			handler(self, agent, server, args)
+		else:
+			server.send_message(agent, ('error', 'unknown_command', command))
+
+	def command_move(self, agent, server, args):
+		move = None
+		if len(args) == 2:
+			try:
+				position, word = args
+				move = parse_move(position, word)
+			except ParseMoveError:
+				pass
+		if move:
+			self.request_move(agent, server, move)
+		else:
+			server.send_message(agent, ('error', 'move_syntax'))
+
+	def command_pass(self, agent, server, args):
+		self.request_pass(agent, server)
+
+	def command_undo(self, agent, server, args):
+		self.request_undo(agent, server)
+
+	def command_get_latency(self, agent, server, args):
+		self.send_latency(agent, server)
+
+	def command_get_word_list(self, agent, server, args):
+		if not args:
 			self.send_word_list(agent, server)
-		elif command == 'get_rack':
+		elif args[0] in self.word_list_modes:
+			self.send_word_list(agent, server, args[0])
+		else:
+			server.send_message(agent, ('error', 'invalid_word_list_mode', args[0]))
+
+	def command_get_rack(self, agent, server, args):
+		try:
+			player_index_string, = args
+			player_index = int(player_index_string)
+		except Exception:
+			player_index = -1
+		self.send_rack(agent, server, player_index)
+
+	def command_get_state(self, agent, server, args):
+		player_index = None
+		if args:
 			try:
 				player_index_string, = args
 				player_index = int(player_index_string)
-			except Exception:
+			except ValueError:
 				player_index = -1
-			self.send_rack(agent, server, player_index)
+			if player_index not in agent.player_indices and not (
+					agent.privileges.admin_privs and 0 <= player_index < len(self.players)):
+				server.send_message(agent, ('error', 'invalid_player_index'))
+				return
+		elif agent.player_indices:
+			player_index = min(agent.player_indices)
+		if self.to_move < 0:
+			server.send_message(agent, ('error', 'game_not_started'))
 		else:
-			server.send_message(agent, 'error unknown_command %s' % command)
+			server.send_message(agent, self.encode_state(player_index))
+
+	def stats_message(self):
+		return ('stats_game', self.id, self.version, self.moves_accepted,
+			self.moves_rejected) + self.move_timings.summary()
+
+	def encode_state(self, player_index=None):
+		if not self.state_cache or self.state_cache[0] != self.version:
+			fields = ('state', self.version, self.to_move, len(self.pool), int(self.finished),
+				str(self.board.cells).replace('\0', '_'), len(self.players))
+			fields += tuple(player.score for player in self.players)
+			self.state_cache = (self.version, fields)
+		message = self.state_cache[1]
+		if player_index is not None:
+			message += ('rack', player_index, self.players[player_index].rack.tiles())
+		return message
 
 	def handle_disconnect(self, agent, server):
 		for player_index in agent.player_indices:
 			self.players[player_index].agent = None
 		self.agents.remove(agent)
 		for player_index in agent.player_indices:
-			self.broadcast(server, 'dropped %d' % player_index)
+			self.broadcast(server, ('dropped', player_index))
 
 	def add_player(self, agent):
 		index = len(self.players)
 		player = ScrabblePlayer(index, agent)
 		self.players.append(player)
-		self.agents.add(agent)
+		if agent:
+			self.agents.add(agent)
 		return player
 
 	def add_watcher(self, agent):
 		self.agents.add(agent)
 
-	def start(self, server):
+	def remove_watcher(self, agent):
+		self.agents.discard(agent)
+
+	def deal(self):
+		self.initial_bag = str(self.pool)
 		for player_index, player in enumerate(self.players):
 			for i in xrange(self.initial_tiles):
 				self.draw_tile(player)
+			if self.time_control:
+				player.clock = GameClock(*self.time_control)
+		self.to_move = 0
+		self.version += 1
+
+	def start(self, server):
+		self.deal()
 
 		for player_index, player in enumerate(self.players):
-			server.send_message(player.agent, 'start_game')
-			server.send_message(player.agent, 'player_index %d' % player_index)
+			server.send_message(player.agent, ('start_game',))
+			server.send_message(player.agent, ('player_index', player_index))
 
 		for player_index, player in enumerate(self.players):
-			self.broadcast(server, 'player %d %s' %
-				(player_index, player.agent.name))
+			self.broadcast(server, ('player', player_index, player.agent.name))
 
-		self.to_move = 0
-		self.print_board()
-		self.print_rack(self.players[self.to_move])
-		self.prompt_turn(server)
-
-	def print_board(self):
-		sys.stdout.write('   ')
-		for col in xrange(self.num_cols):
-			sys.stdout.write(chr(ord('a') + col))
-		sys.stdout.write(' \n')
-		sys.stdout.write('  +')
-		for col in xrange(self.num_cols):
-			sys.stdout.write('-')
-		sys.stdout.write('+\n')
-		for row in xrange(self.num_rows):
-			sys.stdout.write('%2d' % (row + 1))
-			sys.stdout.write('|')
-			for col in xrange(self.num_cols):
-				tile = self.board[row][col]
-				if not tile:
-					sys.stdout.write('.')
-				else:
-					sys.stdout.write(tile)
-			sys.stdout.write('|\n')
-		sys.stdout.write('  +')
-		for col in xrange(self.num_cols):
-			sys.stdout.write('-')
-		sys.stdout.write('+\n')
-
-	def print_rack(self, player):
-		for tile, count in player.rack.iteritems():
-			for j in xrange(count):
-				sys.stdout.write('%c ' % tile)
-		sys.stdout.write('\n')
+		self.end_turn(server)
 
 	def prompt_turn(self, server):
-		self.broadcast(server, 'to_move %d' % self.to_move)
+		self.turn_started = time.time()
+		clock = self.players[self.to_move].clock
+		if clock:
+			self.broadcast(server, ('clock', self.to_move, int(clock.remaining * 1000)))
+		self.broadcast(server, ('to_move', self.to_move))
+
+	def handle_tick(self, server):
+		if self.finished or self.turn_started is None or not self.time_control:
+			return
+		player = self.players[self.to_move]
+		if player.clock.expired(time.time() - self.turn_started):
+			self.forfeit(server, player)
+
+	def forfeit(self, server, player):
+		player.clock.charge(time.time() - self.turn_started)
+		self.forfeited = player.index
+		self.broadcast(server, ('time_forfeit', player.index))
+		self.finish(server)
+
+	def send_latency(self, agent, server):
+		for player in self.players:
+			server.send_message(agent, ('latency', player.index) + player.latency.summary())
+
+	def end_turn(self, server):
+		self.observer.board_changed(self)
+		if self.is_over():
+			self.finish(server)
+		else:
+			self.observer.rack_shown(self, self.players[self.to_move])
+			self.prompt_turn(server)
+
+	def finish(self, server):
+		self.finished = True
+		self.version += 1
+		self.broadcast(server, ('game_over', self.version))
+		for player in self.players:
+			self.broadcast(server, ('final_score', player.index, player.score))
+		for agent in self.agents:
+			self.send_latency(agent, server)
+
+	def is_over(self):
+		if not self.move_history:
+			return False
+		last = self.move_history[-1]
+		if last.move and not self.pool and not self.players[last.player_index].rack:
+			return True
+		pass_limit = 2 * len(self.players)
+		recent = self.move_history[-pass_limit:]
+		return len(recent) == pass_limit and all(not x.move for x in recent)
 
 	def request_move(self, agent, server, move):
 		if self.to_move in agent.player_indices:
 			try:
 				player = self.players[self.to_move]
+				elapsed = time.time() - self.turn_started
+				if player.clock and player.clock.expired(elapsed):
+					self.forfeit(server, player)
+					return
 
-				move_score = self.make_move(player, move)
-				self.broadcast(server, 'move_made %d %s %d' %
-					(self.to_move, str(move), move_score))
-				player.score += move_score
+				started = time.time()
+				try:
+					delta = self.make_move(player, move)
+				finally:
+					self.move_timings.record(time.time() - started)
+				self.moves_accepted += 1
+				player.latency.record(elapsed)
+				if player.clock:
+					player.clock.charge(elapsed)
+				self.broadcast(server, ('move_made', delta.player_index) + move.fields() +
+					(delta.score, self.version))
+				self.end_turn(server)
+			except self.InvalidMove:
+				self.moves_rejected += 1
+				server.send_message(agent, ('error', 'move_invalid'))
 
-				for i in xrange(self.initial_tiles - sum(player.rack.itervalues())):
-					self.draw_tile(player)
+		else:
+			server.send_message(agent, ('error', 'not_to_move'))
 
-				self.to_move = (self.to_move + 1) % len(self.players)
-				self.print_board()
-				self.print_rack(self.players[self.to_move])
-				self.prompt_turn(server)
-			except self.InvalidMove:
-				server.send_message(agent, 'error move_invalid')
+	def request_pass(self, agent, server):
+		if self.to_move in agent.player_indices:
+			player = self.players[self.to_move]
+			elapsed = time.time() - self.turn_started
+			if player.clock and player.clock.expired(elapsed):
+				self.forfeit(server, player)
+				return
+			if player.clock:
+				player.clock.charge(elapsed)
+			delta = self.make_pass(player)
+			player.latency.record(elapsed)
+			self.broadcast(server, ('passed', delta.player_index, self.version))
+			self.end_turn(server)
+		else:
+			server.send_message(agent, ('error', 'not_to_move'))
 
+	def request_undo(self, agent, server):
+		if not agent.privileges.admin_privs:
+			server.send_message(agent, ('error', 'permission_denied', 'undo'))
+		elif not self.move_history:
+			server.send_message(agent, ('error', 'nothing_to_undo'))
 		else:
-			server.send_message(agent, 'error not_to_move')
+			delta = self.undo_move()
+			self.finished = False
+			if delta.move:
+				self.broadcast(server, ('move_undone', delta.player_index) +
+					delta.move.fields() + (self.version,))
+			else:
+				self.broadcast(server, ('move_undone', delta.player_index, 'pass',
+					self.version))
+			self.end_turn(server)
+
+	def request_score_moves(self, agent, server, args):
+		rack = None
+		if len(args) == 2:
+			try:
+				player_index = int(args[0])
+			except ValueError:
+				player_index = -1
+			if player_index not in agent.player_indices:
+				server.send_message(agent, ('error', 'invalid_player_index'))
+				return
+			rack = self.players[player_index].rack
+		elif len(args) != 1:
+			server.send_message(agent, ('error', 'move_syntax'))
+			return
+		fields = args[-1].split()
+		try:
+			if len(fields) % 2:
+				raise ParseMoveError()
+			moves = [parse_move(fields[i], fields[i + 1]) for i in xrange(0, len(fields), 2)]
+		except ParseMoveError:
+			server.send_message(agent, ('error', 'move_syntax'))
+			return
+		scores = self.board.score_moves(moves, rack)
+		server.send_message(agent, ('move_scores', ' '.join(
+			'invalid' if score is None else str(score) for score in scores)))
+
+	analysis_default_moves = 10
+	analysis_max_moves = 100
+	def request_analysis(self, agent, server, args):
+		try:
+			player_index = int(args[0])
+			count = self.analysis_default_moves
+			if len(args) > 1:
+				count, = [int(x) for x in args[1:]]
+		except (IndexError, ValueError):
+			server.send_message(agent, ('error', 'analyze_syntax'))
+			return
+		if player_index < 0 or player_index >= len(self.players):
+			server.send_message(agent, ('error', 'invalid_player_index'))
+		elif (player_index not in agent.player_indices and
+				not agent.privileges.admin_privs):
+			server.send_message(agent, ('error', 'permission_denied', 'analyze'))
+		else:
+			moves = self.analyze(player_index)[:max(0, min(count, self.analysis_max_moves))]
+			server.send_message(agent, ('analysis_count', player_index, len(moves)))
+			for rank, (score, move) in enumerate(moves):
+				server.send_message(agent, ('analysis_move', rank) + move.fields() + (score,))
+
+	def analyze(self, player_index):
+		rack = self.players[player_index].rack
+		key = (self.board.hash, rack.hash)
+		cache = self.word_list.analysis_cache
+		moves = cache.get(key)
+		if moves is None:
+			generator = MoveGenerator(self.word_list, self.letter_scores)
+			moves = generator.generate(self.board, rack)
+			moves.sort(key=lambda x: (-x[0], str(x[1])))
+			del moves[self.analysis_max_moves:]
+			cache.put(key, moves)
+		return moves
+
+	def position_hash(self, player_index=None):
+		if player_index is None:
+			player_index = self.to_move
+		return self.board.hash ^ self.players[player_index].rack.hash
 
 	class InvalidMove(Exception):
 		pass
 	def make_move(self, player, move):
-		board = copy.deepcopy(self.board)
-		rack = copy.deepcopy(player.rack)
-		score = 0
-		row, col = move.start
-		dir_x, dir_y = {ScrabbleMove.horizontal: (1, 0), ScrabbleMove.vertical: (0, 1)}[move.direction]
-		other_x, other_y = {ScrabbleMove.horizontal: (0, 1), ScrabbleMove.vertical: (1, 0)}[move.direction]
-		words_made = []
-		words_made.append((col, row, dir_x, dir_y))
-		for letter_index in xrange(len(move.letters)):
-			tile_x, tile_y = col + dir_x * letter_index, row + dir_y * letter_index
-			if tile_x < 0 or tile_x >= self.num_cols:
-				raise self.InvalidMove()
-			if tile_y < 0 or tile_y >= self.num_rows:
-				raise self.InvalidMove()
-			current_tile = board[tile_y][tile_x]
-			tile = move.letters[letter_index]
-			if current_tile != None and current_tile != tile:
-				raise self.InvalidMove()
-			tile_count = rack.get(tile, 0)
-			if current_tile != tile:
-				if tile_count < 1:
-					raise self.InvalidMove()
-				rack[tile] = tile_count - 1
-			board[tile_y][tile_x] = tile
-			words_made.append((tile_x, tile_y, other_x, other_y))
-
-		for pos_x, pos_y, word_dir_x, word_dir_y in words_made:
-			offsets = [0, 0]
-			scales = [-1, 1]
-			for offset_index in xrange(2):
-				for i in xrange(1, 100000):
-					test_x = pos_x + scales[offset_index] * word_dir_x * i
-					test_y = pos_y + scales[offset_index] * word_dir_y * i
-					if test_x < 0 or test_x >= self.num_cols:
-						break
-					if test_y < 0 or test_y >= self.num_rows:
-						break
-					c = board[test_y][test_x]
-					if c == None:
-						break
-					offsets[offset_index] += scales[offset_index]
-
-			start_offset, end_offset = offsets
-			length = end_offset - start_offset + 1
-
-			if length > 1:
-				word = ''
-				for i in xrange(length):
-					tile_x = pos_x + (start_offset + i) * word_dir_x
-					tile_y = pos_y + (start_offset + i) * word_dir_y
-					letter = board[tile_y][tile_x]
-					word += letter
-					score += self.letter_scores[letter]
-
-				print word
-				if word not in self.word_list:
-					raise self.InvalidMove()
-
-		self.board = board
-		player.rack = rack
-
-		return score
+		dir_x, dir_y = self.direction_steps[move.direction]
+		board = self.board
+		delta = ScrabbleMoveDelta(player.index, move)
+		delta.score, delta.placed, main_word, cross_words = board.evaluate(move, player.rack)
+
+		board.place(delta.placed)
+		if len(main_word) > 1:
+			delta.words.append(main_word)
+		if cross_words:
+			delta.words.extend(word for word in (board.word_at(tile_x, tile_y, dir_y, dir_x)
+				for tile_y, tile_x, tile in delta.placed) if len(word) > 1)
+
+		for tile_y, tile_x, tile in delta.placed:
+			self.remove_tile(player, tile)
+			delta.rack_used.append(tile)
+		player.score += delta.score
+		for word in delta.words:
+			self.observer.word_formed(self, word)
+
+		for i in xrange(self.initial_tiles - len(player.rack)):
+			tile = self.draw_tile(player)
+			if tile is None:
+				break
+			delta.tiles_drawn.append(tile)
+
+		delta.previous_to_move = self.to_move
+		delta.board_hash = self.board.hash
+		self.to_move = (player.index + 1) % len(self.players)
+		self.move_history.append(delta)
+		self.version += 1
+		return delta
+
+	def make_pass(self, player):
+		delta = ScrabbleMoveDelta(player.index, None)
+		delta.previous_to_move = self.to_move
+		delta.board_hash = self.board.hash
+		self.to_move = (player.index + 1) % len(self.players)
+		self.move_history.append(delta)
+		self.version += 1
+		return delta
+
+	def undo_move(self):
+		delta = self.move_history.pop()
+		player = self.players[delta.player_index]
+		for tile in reversed(delta.tiles_drawn):
+			self.remove_tile(player, tile)
+			self.pool.put_back(tile)
+		for tile in delta.rack_used:
+			player.rack.add(tile)
+		self.board.remove(delta.placed)
+		player.score -= delta.score
+		self.to_move = delta.previous_to_move
+		self.version += 1
+		return delta
 
 	def draw_tile(self, player):
-		tile = self.pool.pop()
-		player.rack[tile] = player.rack.get(tile, 0) + 1
-
-	def send_word_list(self, agent, server):
-		server.send_message(agent, 'word_count %d' % len(self.word_list))
-		for index, word in enumerate(self.word_list):
-			server.send_message(agent, 'word %d %s' % (index, word))
+		tile = self.pool.draw()
+		if tile is not None:
+			player.rack.add(tile)
+		return tile
+
+	def remove_tile(self, player, tile):
+		player.rack.remove(tile)
+
+	word_list_modes = ('lines', 'bulk', 'zlib', 'file')
+	word_list_chunk_size = 1024
+	def send_word_list(self, agent, server, mode='lines'):
+		if mode == 'lines':
+			server.send_message(agent, ('word_count', len(self.word_list)))
+			for index, word in enumerate(self.word_list):
+				server.send_message(agent, ('word', index, word))
+		elif mode == 'file':
+			path = getattr(self.word_list, 'path', None)
+			if path:
+				server.send_message(agent, ('word_list_file', os.path.abspath(path)))
+			else:
+				server.send_message(agent, ('error', 'word_list_file_unavailable'))
+		else:
+			for message in self.encode_word_list(mode):
+				server.send_message(agent, message)
+
+	def encode_word_list(self, mode):
+		encodings = self.word_list.encodings
+		if mode not in encodings:
+			messages = [('word_count', len(self.word_list))]
+			if mode == 'bulk':
+				chunk = []
+				start = 0
+				for word in self.word_list:
+					chunk.append(word)
+					if len(chunk) == self.word_list_chunk_size:
+						messages.append(('words', start, ' '.join(chunk)))
+						start += len(chunk)
+						chunk = []
+				if chunk:
+					messages.append(('words', start, ' '.join(chunk)))
+			else:
+				payload = zlib.compress('\n'.join(self.word_list), 9)
+				messages.append(('word_list_zlib', base64.b64encode(payload)))
+			encodings[mode] = [EncodedMessage(x) for x in messages]
+		return encodings[mode]
 
 	def send_rack(self, agent, server, player_index):
 		if player_index in agent.player_indices:
 			player = self.players[player_index]
-			server.send_message(agent, 'tile_count %d' % sum(player.rack.itervalues()))
-			i = 0
-			for tile, count in player.rack.iteritems():
-				for j in xrange(count):
-					server.send_message(agent, 'tile %d %c' % (i, tile))
-					i += 1
+			server.send_message(agent, ('tile_count', len(player.rack)))
+			for i, tile in enumerate(player.rack.tiles()):
+				server.send_message(agent, ('tile', i, tile))
 		else:
-			server.send_message(agent, 'error invalid_player_index')
+			server.send_message(agent, ('error', 'invalid_player_index'))
 
 	def broadcast(self, server, message):
-		for agent in self.agents:
-			server.send_message(agent, message)
+		server.broadcast(self.agents, message)
+
+	game_over_commands = ('move', 'pass')
+	command_handlers = {
+		'move': command_move,
+		'pass': command_pass,
+		'undo': command_undo,
+		'get_latency': command_get_latency,
+		'get_word_list': command_get_word_list,
+		'get_rack': command_get_rack,
+		'get_state': command_get_state,
+		'score_moves': request_score_moves,
+		'analyze': request_analysis}
+
+class LRUCache(object):
+	def __init__(self, limit):
+		self.limit = limit
+		self.items = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.items)
+
+	def get(self, key):
+		try:
+			value = self.items.pop(key)
+		except KeyError:
+			self.misses += 1
+			return None
+		self.items[key] = value
+		self.hits += 1
+		return value
+
+	def put(self, key, value):
+		self.items.pop(key, None)
+		self.items[key] = value
+		if len(self.items) > self.limit:
+			self.items.popitem(last=False)
+
+class MoveGenerator(object):
+	def __init__(self, lexicon, letter_scores=None):
+		self.lexicon = lexicon
+		self.letter_scores = letter_scores or ScrabbleGame.letter_scores
+
+	def generate(self, board, rack):
+		rack = dict((tile, count) for tile, count in rack.iteritems()
+			if count > 0 and tile in self.letter_scores)
+		moves = []
+		self.generate_lines(board, rack, ScrabbleMove.horizontal, moves)
+		self.generate_lines(board, rack, ScrabbleMove.vertical, moves)
+		return moves
+
+	def best_move(self, board, rack):
+		moves = self.generate(board, rack)
+		if not moves:
+			return None
+		return max(moves, key=lambda x: x[0])
+
+	def generate_lines(self, board, rack, direction, moves):
+		num_cols = board.num_cols
+		if direction == ScrabbleMove.horizontal:
+			num_lines, line_length = board.num_rows, board.num_cols
+			line_indices = [[line * num_cols + pos for pos in xrange(line_length)]
+				for line in xrange(num_lines)]
+		else:
+			num_lines, line_length = board.num_cols, board.num_rows
+			line_indices = [[pos * num_cols + line for pos in xrange(line_length)]
+				for line in xrange(num_lines)]
+		cells = board.cells
+		cross_masks = board.cross_masks[direction]
+		cross_scores = board.cross_scores[direction]
+
+		for line_index, indices in enumerate(line_indices):
+			anchors = [board.anchors[index] for index in indices]
+			if not any(anchors):
+				continue
+			line = [chr(cells[index]) if cells[index] else None for index in indices]
+			masks = [cross_masks[index] for index in indices]
+			scores = [cross_scores[index] for index in indices]
+
+			context = (line, line_index, masks, scores, anchors, rack, direction, moves)
+			for pos in xrange(line_length):
+				if not anchors[pos]:
+					continue
+				if pos > 0 and line[pos - 1] is not None:
+					start = pos
+					while start > 0 and line[start - 1] is not None:
+						start -= 1
+					prefix = ''.join(line[start:pos])
+					node = self.lexicon.lookup(prefix)
+					if node >= 0:
+						score = sum(self.letter_scores[x] for x in prefix)
+						self.extend_right(context, start, pos, pos, list(prefix),
+							node, score, 0, 0)
+				else:
+					limit = 0
+					while (pos - limit > 0 and line[pos - limit - 1] is None and
+							not anchors[pos - limit - 1]):
+						limit += 1
+					self.extend_left(context, pos, [], self.lexicon.root, limit, 0)
+
+	def extend_left(self, context, anchor, partial, node, limit, score):
+		start = anchor - len(partial)
+		self.extend_right(context, start, anchor, anchor, partial, node, score, 0,
+			len(partial))
+		if limit > 0:
+			rack = context[5]
+			for letter, child in self.lexicon.edges(node):
+				if rack.get(letter, 0) > 0:
+					rack[letter] -= 1
+					partial.append(letter)
+					self.extend_left(context, anchor, partial, child, limit - 1,
+						score + self.letter_scores[letter])
+					partial.pop()
+					rack[letter] += 1
+
+	def extend_right(self, context, start, anchor, pos, partial, node, score,
+			cross_total, placed):
+		line, line_index, masks, scores, anchors, rack, direction, moves = context
+		lexicon = self.lexicon
+		if pos >= len(line) or line[pos] is None:
+			if pos > anchor and placed and len(partial) > 1 and lexicon.is_final(node):
+				if direction == ScrabbleMove.horizontal:
+					start_pos = (line_index, start)
+				else:
+					start_pos = (start, line_index)
+				moves.append((score + cross_total,
+					ScrabbleMove(start_pos, direction, list(partial))))
+			if pos >= len(line):
+				return
+			mask = masks[pos]
+			cross_score = scores[pos]
+			for letter, child in lexicon.edges(node):
+				if rack.get(letter, 0) < 1 or not mask & letter_bits[letter]:
+					continue
+				letter_score = self.letter_scores[letter]
+				extra = 0
+				if cross_score >= 0:
+					extra = cross_score + letter_score
+				rack[letter] -= 1
+				partial.append(letter)
+				self.extend_right(context, start, anchor, pos + 1, partial, child,
+					score + letter_score, cross_total + extra, placed + 1)
+				partial.pop()
+				rack[letter] += 1
+		else:
+			letter = line[pos]
+			child = lexicon.child(node, letter)
+			if child >= 0:
+				partial.append(letter)
+				self.extend_right(context, start, anchor, pos + 1, partial, child,
+					score + self.letter_scores[letter], cross_total, placed)
+				partial.pop()
+
+class GameRecordError(Exception):
+	pass
+
+class GameRecord(object):
+	version = 2
+	supported_versions = (1, 2)
+
+	def __init__(self, bag='', names=None):
+		self.bag = bag
+		self.names = names or []
+		self.turns = []
+		self.forfeited = None
+		self.final_scores = None
+		self.board_hash = None
+
+	@classmethod
+	def from_game(cls, game):
+		names = [(player.agent.name if player.agent else 'player%d' % player.index)
+			for player in game.players]
+		record = cls(game.initial_bag, names)
+		for delta in game.move_history:
+			if delta.move:
+				position, word = str(delta.move).split()
+				record.turns.append((delta.player_index, position, word, delta.score))
+			else:
+				record.turns.append((delta.player_index, None, None, 0))
+		if game.finished:
+			record.final_scores = [player.score for player in game.players]
+		record.forfeited = game.forfeited
+		record.board_hash = game.board.hash
+		return record
+
+	def format(self):
+		lines = ['game %d %d' % (self.version, len(self.names)), 'bag %s' % self.bag]
+		for index, name in enumerate(self.names):
+			lines.append('player %d "%s"' % (index, name))
+		for player_index, position, word, score in self.turns:
+			if position:
+				lines.append('m %d %s %s %d' % (player_index, position, word, score))
+			else:
+				lines.append('p %d' % player_index)
+		if self.board_hash is not None:
+			lines.append('hash %016x' % self.board_hash)
+		if self.forfeited is not None:
+			lines.append('forfeit %d' % self.forfeited)
+		if self.final_scores is not None:
+			lines.append('end %s' % ' '.join(str(x) for x in self.final_scores))
+		return '\n'.join(lines) + '\n'
+
+def read_game_records(f):
+	record = None
+	for line_number, line in enumerate(f, 1):
+		try:
+			args = explode_args(line)
+			if not args:
+				continue
+			kind = args[0]
+			if kind == 'game':
+				if int(args[1]) not in GameRecord.supported_versions:
+					raise GameRecordError('line %d: unsupported record version' % line_number)
+				record = GameRecord()
+			elif record is None:
+				raise GameRecordError('line %d: expected "game"' % line_number)
+			elif kind == 'bag':
+				record.bag = args[1]
+			elif kind == 'player':
+				record.names.append(args[2])
+			elif kind == 'm':
+				player_index, position, word, score = args[1:]
+				record.turns.append((int(player_index), position, word, int(score)))
+			elif kind == 'p':
+				record.turns.append((int(args[1]), None, None, 0))
+			elif kind == 'hash':
+				record.board_hash = int(args[1], 16)
+			elif kind == 'forfeit':
+				record.forfeited = int(args[1])
+			elif kind == 'end':
+				record.final_scores = [int(x) for x in args[1:]]
+				yield record
+				record = None
+			else:
+				raise GameRecordError('line %d: unknown entry "%s"' % (line_number, kind))
+		except (ExplodeError, IndexError, ValueError):
+			raise GameRecordError('line %d: malformed entry' % line_number)
+
+def replay_game_record(record, word_list):
+	game = ScrabbleGame(0, word_list)
+	for name in record.names:
+		game.add_player(None)
+	game.pool = TileBag(record.bag)
+	game.deal()
+	mismatches = 0
+	for player_index, position, word, score in record.turns:
+		if player_index != game.to_move:
+			raise GameRecordError('player %d moved out of turn' % player_index)
+		player = game.players[player_index]
+		if position:
+			try:
+				delta = game.make_move(player, parse_move(position, word))
+			except (ParseMoveError, ScrabbleGame.InvalidMove):
+				raise GameRecordError('move "%s %s" rejected' % (position, word))
+			if delta.score != score:
+				mismatches += 1
+		else:
+			game.make_pass(player)
+	game.forfeited = record.forfeited
+	game.finished = game.is_over() or record.forfeited is not None
+	return game, mismatches
+
+def run_replay(record_path, word_list_path, verbose=False):
+	try:
+		word_list = load_word_list(word_list_path)
+	except WordListLoadError, e:
+		print 'unable to load word list from "%s".' % word_list_path
+		return
+	games = changed = invalid = 0
+	start_time = time.time()
+	try:
+		f = open(record_path, 'r')
+	except IOError:
+		print 'unable to open game records from "%s".' % record_path
+		return
+	try:
+		for record in read_game_records(f):
+			games += 1
+			try:
+				game, mismatches = replay_game_record(record, word_list)
+			except GameRecordError, e:
+				invalid += 1
+				if verbose:
+					print 'game %d: invalid: %s' % (games, e)
+				continue
+			scores = [player.score for player in game.players]
+			board_changed = (record.board_hash is not None and
+				record.board_hash != game.board.hash)
+			if mismatches or scores != record.final_scores or board_changed:
+				changed += 1
+				if verbose:
+					print 'game %d: %d moves rescored, final scores %s (recorded %s)%s' % (
+						games, mismatches, ' '.join(str(x) for x in scores),
+						' '.join(str(x) for x in record.final_scores),
+						', final board differs' if board_changed else '')
+	except GameRecordError, e:
+		print 'unable to read game records: %s' % e
+	finally:
+		f.close()
+	elapsed = time.time() - start_time
+	print '%d games replayed in %.2fs (%.0f games/s): %d unchanged, %d rescored, %d invalid' % (
+		games, elapsed, games / max(elapsed, 1e-9), games - changed - invalid,
+		changed, invalid)
 
 class AppOptions(object):
 	execute_none = 0
 	execute_game = 1
 	execute_dummy_engine = 2
+	execute_engine = 3
+	execute_tournament = 4
+	execute_replay = 5
+	execute_compile_words = 6
+	execute_simulate = 7
 
 	def __init__(self):
 		self.execute_mode = self.execute_none
 		self.child_engines = []
 		self.word_list_path = None
+		self.event_loop = False
+		self.queue_limit = 256
+		self.quiet = False
+		self.log_path = None
+		self.record_path = None
+		self.verbose = False
+		self.time_control = None
+		self.pairing = Tournament.round_robin
+		self.game_count = 100
+		self.jobs = 0
+		self.output_path = None
+		self.listen_address = None
+		self.connect_address = None
+		self.engine_name = 'engine'
+		self.connections = 1
+		self.warm_count = 0
+		self.framing = 'lines'
+		self.send_limit = 1 << 20
+		self.slow_consumer_policy = 'snapshot'
+		self.strategies = []
+		self.seed = 0
+		self.profile_path = None
 
 class OptionArgumentMissingError(Exception):
 	pass
 
+class OptionArgumentInvalidError(Exception):
+	pass
+
 def parse_command_line(argv):
 
 	options = AppOptions()
@@ -689,6 +2591,16 @@ def parse_command_line(argv):
 			options.execute_mode = AppOptions.execute_game
 		elif command == 'dummy_engine':
 			options.execute_mode = AppOptions.execute_dummy_engine
+		elif command == 'engine':
+			options.execute_mode = AppOptions.execute_engine
+		elif command == 'tournament':
+			options.execute_mode = AppOptions.execute_tournament
+		elif command == 'replay':
+			options.execute_mode = AppOptions.execute_replay
+		elif command in ('compile_words', 'compile-words'):
+			options.execute_mode = AppOptions.execute_compile_words
+		elif command == 'simulate':
+			options.execute_mode = AppOptions.execute_simulate
 
 	if options.execute_mode == AppOptions.execute_none:
 		options.execute_mode = AppOptions.execute_game
@@ -703,38 +2615,377 @@ def parse_command_line(argv):
 			if arg == '-w' or arg == '--words':
 				path = args.pop(0)
 				options.word_list_path = path
+			if arg == '--event-loop':
+				options.event_loop = True
+			if arg == '-q' or arg == '--quiet':
+				options.quiet = True
+			if arg == '--log':
+				options.log_path = args.pop(0)
+			if arg == '-r' or arg == '--record':
+				options.record_path = args.pop(0)
+			if arg == '-v' or arg == '--verbose':
+				options.verbose = True
+			if arg == '-t' or arg == '--time':
+				increment = options.time_control and options.time_control[1] or 0.0
+				options.time_control = (float(args.pop(0)), increment)
+			if arg == '--increment':
+				total = options.time_control and options.time_control[0] or 60.0
+				options.time_control = (total, float(args.pop(0)))
+			if arg == '--queue-limit':
+				options.queue_limit = int(args.pop(0))
+			if arg == '-p' or arg == '--pairing':
+				options.pairing = args.pop(0).lower()
+			if arg == '-n' or arg == '--games':
+				options.game_count = int(args.pop(0))
+			if arg == '-j' or arg == '--jobs':
+				options.jobs = int(args.pop(0))
+			if arg == '-o' or arg == '--output':
+				options.output_path = args.pop(0)
+			if arg == '--listen':
+				options.listen_address = args.pop(0)
+			if arg == '--connect':
+				options.connect_address = args.pop(0)
+			if arg == '--name':
+				options.engine_name = args.pop(0)
+			if arg == '--connections':
+				options.connections = int(args.pop(0))
+			if arg == '--warm':
+				options.warm_count = int(args.pop(0))
+			if arg == '--framing':
+				options.framing = args.pop(0).lower()
+			if arg == '--send-limit':
+				options.send_limit = int(args.pop(0))
+			if arg == '--slow-consumers':
+				options.slow_consumer_policy = args.pop(0).lower()
+			if arg == '-s' or arg == '--strategy':
+				options.strategies.append(args.pop(0).lower())
+			if arg == '--seed':
+				options.seed = int(args.pop(0))
+			if arg == '--profile':
+				options.profile_path = args.pop(0)
 		except IndexError:
 			raise OptionArgumentMissingError('The option "%s" requires an argument.' % arg)
+		except ValueError:
+			raise OptionArgumentInvalidError('The option "%s" requires a numeric argument.' % arg)
 
 	return options
 
+class LexiconBuilderNode(object):
+	__slots__ = ['final', 'edges']
+
+	def __init__(self):
+		self.final = False
+		self.edges = {}
+
+	def signature(self):
+		return (self.final, tuple(sorted((letter, id(child))
+			for letter, child in self.edges.iteritems())))
+
+class LexiconBuilder(object):
+	def __init__(self):
+		self.root = LexiconBuilderNode()
+		self.register = {}
+		self.unchecked = []
+		self.previous_word = ''
+		self.word_count = 0
+
+	def add(self, word):
+		if word <= self.previous_word:
+			if word == self.previous_word:
+				return
+			raise ValueError('words must be added in sorted order')
+		common = 0
+		limit = min(len(word), len(self.previous_word))
+		while common < limit and word[common] == self.previous_word[common]:
+			common += 1
+		self.minimize(common)
+
+		if self.unchecked:
+			node = self.unchecked[-1][2]
+		else:
+			node = self.root
+		for letter in word[common:]:
+			child = LexiconBuilderNode()
+			node.edges[letter] = child
+			self.unchecked.append((node, letter, child))
+			node = child
+		node.final = True
+		self.previous_word = word
+		self.word_count += 1
+
+	def minimize(self, down_to):
+		while len(self.unchecked) > down_to:
+			parent, letter, child = self.unchecked.pop()
+			signature = child.signature()
+			existing = self.register.get(signature)
+			if existing is not None:
+				parent.edges[letter] = existing
+			else:
+				self.register[signature] = child
+
+	def finish(self):
+		self.minimize(0)
+		self.register = None
+
+		indices = {id(self.root): 0}
+		order = [self.root]
+		i = 0
+		while i < len(order):
+			for letter, child in sorted(order[i].edges.iteritems()):
+				if id(child) not in indices:
+					indices[id(child)] = len(order)
+					order.append(child)
+			i += 1
+
+		nodes = array.array('i')
+		letters = []
+		targets = array.array('i')
+		for node in order:
+			nodes.append((len(letters) << 1) | int(node.final))
+			for letter, child in sorted(node.edges.iteritems()):
+				letters.append(letter)
+				targets.append(indices[id(child)])
+		nodes.append(len(letters) << 1)
+
+		return Lexicon(nodes, ''.join(letters), targets, self.word_count)
+
+class MappedIntArray(object):
+	item = struct.Struct('<i')
+
+	def __init__(self, data, offset, length):
+		self.data = data
+		self.offset = offset
+		self.length = length
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, index):
+		if index < 0 or index >= self.length:
+			raise IndexError(index)
+		return self.item.unpack_from(self.data, self.offset + 4 * index)[0]
+
+class MappedString(object):
+	def __init__(self, data, offset, length):
+		self.data = data
+		self.offset = offset
+		self.length = length
+
+	def __len__(self):
+		return self.length
+
+	def __str__(self):
+		return self.data[self.offset:self.offset + self.length]
+
+	def __getitem__(self, index):
+		if index < 0 or index >= self.length:
+			raise IndexError(index)
+		return self.data[self.offset + index]
+
+	def find(self, string, start, end):
+		index = self.data.find(string, self.offset + start, self.offset + end)
+		if index < 0:
+			return -1
+		return index - self.offset
+
+class Lexicon(object):
+	root = 0
+	analysis_cache_limit = 1024
+	file_magic = 'RBLDAWG1'
+	file_header = struct.Struct('<8sIII')
+
+	def __init__(self, nodes, edge_letters, edge_targets, word_count):
+		self.nodes = nodes
+		self.edge_letters = edge_letters
+		self.edge_targets = edge_targets
+		self.word_count = word_count
+		self.path = None
+		self.encodings = {}
+		self.cross_check_cache = {}
+		self.analysis_cache = LRUCache(self.analysis_cache_limit)
+
+	@classmethod
+	def from_words(cls, words):
+		builder = LexiconBuilder()
+		for word in sorted(set(words)):
+			builder.add(word)
+		return builder.finish()
+
+	@classmethod
+	def from_mapped_file(cls, f):
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(data) < cls.file_header.size:
+			raise WordListLoadError('truncated')
+		magic, node_count, edge_count, word_count = cls.file_header.unpack_from(data)
+		size = cls.file_header.size + 4 * (node_count + edge_count) + edge_count
+		if magic != cls.file_magic or len(data) != size:
+			raise WordListLoadError('corrupt')
+		return MappedLexicon(data, node_count, edge_count, word_count)
+
+	def write(self, f):
+		nodes = array.array('i', self.nodes)
+		targets = array.array('i', self.edge_targets)
+		if sys.byteorder != 'little':
+			nodes.byteswap()
+			targets.byteswap()
+		f.write(self.file_header.pack(self.file_magic, len(nodes), len(targets),
+			self.word_count))
+		f.write(nodes.tostring())
+		f.write(targets.tostring())
+		f.write(str(self.edge_letters))
+
+	def __len__(self):
+		return self.word_count
+
+	def __contains__(self, word):
+		node = self.lookup(word)
+		return node >= 0 and self.is_final(node)
+
+	def __iter__(self):
+		return self.words_with_prefix('')
+
+	def node_count(self):
+		return len(self.nodes) - 1
+
+	def is_final(self, node):
+		return bool(self.nodes[node] & 1)
+
+	def child(self, node, letter):
+		index = self.edge_letters.find(letter,
+			self.nodes[node] >> 1, self.nodes[node + 1] >> 1)
+		if index < 0:
+			return -1
+		return self.edge_targets[index]
+
+	def edges(self, node):
+		for index in xrange(self.nodes[node] >> 1, self.nodes[node + 1] >> 1):
+			yield self.edge_letters[index], self.edge_targets[index]
+
+	def lookup(self, prefix):
+		node = self.root
+		for letter in prefix:
+			node = self.child(node, letter)
+			if node < 0:
+				return -1
+		return node
+
+	def has_prefix(self, prefix):
+		return self.lookup(prefix) >= 0
+
+	def words_with_prefix(self, prefix):
+		node = self.lookup(prefix)
+		if node < 0:
+			return
+		stack = [(node, prefix)]
+		while stack:
+			node, word = stack.pop()
+			if self.is_final(node):
+				yield word
+			stack.extend(reversed([(child, word + letter)
+				for letter, child in self.edges(node)]))
+
+class MappedLexicon(Lexicon):
+	node_range = struct.Struct('<ii')
+	target = struct.Struct('<i')
+
+	def __init__(self, data, node_count, edge_count, word_count):
+		self.data = data
+		self.nodes_offset = self.file_header.size
+		self.targets_offset = self.nodes_offset + 4 * node_count
+		self.letters_offset = self.targets_offset + 4 * edge_count
+		Lexicon.__init__(self, MappedIntArray(data, self.nodes_offset, node_count),
+			MappedString(data, self.letters_offset, edge_count),
+			MappedIntArray(data, self.targets_offset, edge_count), word_count)
+
+	def is_final(self, node):
+		return bool(ord(self.data[self.nodes_offset + 4 * node]) & 1)
+
+	def child(self, node, letter):
+		start, end = self.node_range.unpack_from(self.data, self.nodes_offset + 4 * node)
+		index = self.data.find(letter, self.letters_offset + (start >> 1),
+			self.letters_offset + (end >> 1))
+		if index < 0:
+			return -1
+		return self.target.unpack_from(self.data,
+			self.targets_offset + 4 * (index - self.letters_offset))[0]
+
+	def edges(self, node):
+		start, end = self.node_range.unpack_from(self.data, self.nodes_offset + 4 * node)
+		start >>= 1
+		end >>= 1
+		letters = self.data[self.letters_offset + start:self.letters_offset + end]
+		targets = struct.unpack_from('<%di' % (end - start), self.data,
+			self.targets_offset + 4 * start)
+		return zip(letters, targets)
+
 class WordListLoadError(Exception):
 	pass
 def load_word_list(word_list_path):
 	word_re = re.compile(r'^([a-z]+)$')
-	words = set()
+	words = []
 	try:
-		f = file(word_list_path, 'r')
+		f = file(word_list_path, 'rb')
 	except IOError:
 		raise WordListLoadError('word_list_path')
+	if f.read(len(Lexicon.file_magic)) == Lexicon.file_magic:
+		try:
+			lexicon = Lexicon.from_mapped_file(f)
+		finally:
+			f.close()
+		lexicon.path = word_list_path
+		return lexicon
+	f.seek(0)
 	for line in f:
 		candidate = line.strip()
 		m = word_re.match(candidate)
 		if m:
 			word = m.group(0)
-			words.add(word)
-	return words
+			words.append(word)
+	lexicon = Lexicon.from_words(words)
+	lexicon.path = word_list_path
+	return lexicon
 
-def run_game(args, child_engines, word_list_path):
+def compile_word_list(word_list_path, output_path):
+	start_time = time.time()
+	try:
+		lexicon = load_word_list(word_list_path)
+	except WordListLoadError, e:
+		print 'unable to load word list from "%s".' % word_list_path
+		return
+	temporary_path = output_path + '.tmp'
+	f = open(temporary_path, 'wb')
+	try:
+		lexicon.write(f)
+	finally:
+		f.close()
+	os.rename(temporary_path, output_path)
+	print 'compiled %d words (%d nodes) to "%s" in %.2fs' % (len(lexicon),
+		lexicon.node_count(), output_path, time.time() - start_time)
+
+def run_game(args, child_engines, word_list_path, event_loop=False,
+		queue_limit=0, observer=None, record_path=None, time_control=None,
+		listen_address=None, send_limit=1 << 20, slow_consumer_policy='snapshot'):
 	try:
 		word_list = load_word_list(word_list_path)
 	except WordListLoadError, e:
 		print 'unable to load word list from "word_list_path".'
 		return
+	listener = None
+	if listen_address:
+		try:
+			listener = ServerChannelListener(listen_address)
+		except (ValueError, socket.error), e:
+			print 'unable to listen on "%s".' % listen_address
+			return
+	if observer is None:
+		observer = ConsoleGameObserver()
 	def create_game(id):
-		return ScrabbleGame(id, word_list)
+		return ScrabbleGame(id, word_list, observer, time_control)
 	model = GameServerModel(create_game)
-	server = Server(model)
+	if event_loop:
+		server = EventLoopServer(model, queue_limit, send_limit, slow_consumer_policy)
+	else:
+		server = Server(model, queue_limit, send_limit, slow_consumer_policy)
 	server.start()
 
 	std_channel = create_std_server_channel(0, model)
@@ -743,7 +2994,7 @@ def run_game(args, child_engines, word_list_path):
 
 	game = model.create_game()
 
-	for engine in child_engines:
+	for channel_id, engine in enumerate(child_engines, 1):
 
 		if engine == '-':
 
@@ -753,16 +3004,20 @@ def run_game(args, child_engines, word_list_path):
 
 		else:
 
-			child_process_channel = create_child_process_server_channel(1, model, engine)
+			child_process_channel = create_child_process_server_channel(channel_id, model, engine)
 			child_process_channel.agent.set_name('player%d' % child_process_channel.agent.id)
 			server.add_channel(child_process_channel)
 
-			class Thread(threading.Thread):
-				def run(self):
-					server.listen_to_channel(child_process_channel.id)
-			child_thread = Thread()
-			child_thread.setDaemon(True)
-			child_thread.start()
+			if not event_loop:
+				class Thread(threading.Thread):
+					def __init__(self, channel_id):
+						threading.Thread.__init__(self)
+						self.channel_id = channel_id
+					def run(self):
+						server.listen_to_channel(self.channel_id)
+				child_thread = Thread(child_process_channel.id)
+				child_thread.setDaemon(True)
+				child_thread.start()
 
 			child_agent_player = game.add_player(child_process_channel.agent)
 			child_process_channel.agent.set_game(game)
@@ -771,61 +3026,1017 @@ def run_game(args, child_engines, word_list_path):
 	std_channel.agent.set_game(game)
 	game.add_watcher(std_channel.agent)
 
+	if listener:
+		channel_ids = [len(child_engines)]
+		def accept(io):
+			channel_ids[0] += 1
+			server.add_channel(create_socket_server_channel(channel_ids[0], model, io))
+		server.add_listener(listener, accept)
+
 	model.start_game(game, server)
+	server.flush()
 
-	server.listen_to_channel(std_channel.id)
+	if event_loop:
+		server.run()
+	else:
+		server.listen_to_channel(std_channel.id)
+	if listener:
+		listener.close()
 
+	observer.close()
+	if record_path and game.finished:
+		append_game_record(record_path, GameRecord.from_game(game).format())
 	print 'main thread exitting'
 
+class GameResult(object):
+	def __init__(self, game=None):
+		self.scores = None
+		self.forfeited = None
+		self.record = None
+		self.latencies = []
+		self.position_hashes = []
+		if game:
+			self.latencies = [player.latency for player in game.players]
+			self.position_hashes = [delta.board_hash for delta in game.move_history
+				if delta.move]
+			if game.finished:
+				self.scores = [player.score for player in game.players]
+				self.forfeited = game.forfeited
+				self.record = GameRecord.from_game(game).format()
+
+	def completed(self):
+		return self.scores is not None
+
+def run_headless_game(model, engines):
+	server = EventLoopServer(model)
+	game = model.create_game()
+	agents = []
+	for channel_id, engine in enumerate(engines, 1):
+		channel = create_child_process_server_channel(channel_id, model, engine)
+		channel.agent.set_name('player%d' % channel.agent.id)
+		server.add_channel(channel)
+		player = game.add_player(channel.agent)
+		channel.agent.set_game(game)
+		channel.agent.add_player_index(player.index)
+		agents.append(channel.agent)
+
+	model.start_game(game, server)
+	server.flush()
+	server.run(lambda: game.finished or
+		any(player.agent is None for player in game.players))
+
+	for agent in agents:
+		model.agents.pop(agent.id, None)
+	model.remove_game(game)
+	return GameResult(game)
+
+def append_game_record(record_path, text):
+	f = open(record_path, 'a')
+	try:
+		f.write(text)
+	finally:
+		f.close()
+
+tournament_worker_state = {}
+def start_worker_profiler():
+	profiler = profiler_state.get('profiler')
+	if profiler and profiler.pid != os.getpid():
+		worker_profiler = SamplingProfiler('%s.worker.%d' % (profiler.path, os.getpid()),
+			profiler.interval, save_interval=1.0)
+		worker_profiler.start()
+
+def init_tournament_worker(word_list_path, time_control):
+	start_worker_profiler()
+	sys.stdout = open(os.devnull, 'w')
+	word_list = load_word_list(word_list_path)
+	def create_game(id):
+		return ScrabbleGame(id, word_list, time_control=time_control)
+	tournament_worker_state['model'] = GameServerModel(create_game)
+
+def play_tournament_game(task):
+	seats, engines = task
+	model = tournament_worker_state['model']
+	return seats, run_headless_game(model, engines)
+
+class TournamentStanding(object):
+	initial_rating = 1500.0
+
+	def __init__(self, engine):
+		self.engine = engine
+		self.games = 0
+		self.wins = 0
+		self.draws = 0
+		self.losses = 0
+		self.total_score = 0
+		self.rating = self.initial_rating
+		self.opponents = set()
+		self.forfeits = 0
+		self.latency = LatencyHistogram()
+
+	def points(self):
+		return self.wins + 0.5 * self.draws
+
+class Tournament(object):
+	round_robin = 'round_robin'
+	swiss = 'swiss'
+	pairings = (round_robin, swiss)
+	elo_k = 16.0
+
+	def __init__(self, engines, pairing, game_count, record_path=None,
+			concurrency=1):
+		self.engines = engines
+		self.concurrency = concurrency
+		self.record_path = record_path
+		self.pairing = pairing
+		self.game_count = game_count
+		self.standings = [TournamentStanding(engine) for engine in engines]
+		self.games_played = 0
+		self.games_aborted = 0
+		self.position_counts = {}
+		self.repeated_positions = 0
+
+	def run(self, play_games):
+		if self.pairing == self.swiss:
+			round_index = 0
+			while self.games_played + self.games_aborted < self.game_count:
+				remaining = self.game_count - self.games_played - self.games_aborted
+				pairs = []
+				scheduled = [set() for engine in self.engines]
+				while not pairs or len(pairs) < min(remaining, self.concurrency):
+					pairs.extend(self.swiss_round(round_index, remaining - len(pairs),
+						scheduled))
+					round_index += 1
+				self.play(play_games, pairs)
+		else:
+			self.play(play_games, self.round_robin_pairs())
+
+	def play(self, play_games, pairs):
+		tasks = [(seats, [self.engines[x] for x in seats]) for seats in pairs]
+		for seats, result in play_games(tasks):
+			self.record(seats, result)
+			if result.record and self.record_path:
+				append_game_record(self.record_path, result.record)
+
+	def round_robin_pairs(self):
+		count = len(self.engines)
+		pairs = [(a, b) for a in xrange(count) for b in xrange(count) if a != b]
+		return [pairs[i % len(pairs)] for i in xrange(self.game_count)]
+
+	def swiss_round(self, round_index, limit, scheduled):
+		unpaired = sorted(xrange(len(self.engines)), key=lambda x:
+			(-self.standings[x].points(), -self.standings[x].rating))
+		pairs = []
+		while len(unpaired) >= 2 and len(pairs) < limit:
+			a = unpaired.pop(0)
+			fresh = [x for x in unpaired if x not in self.standings[a].opponents]
+			unscheduled = [x for x in fresh or unpaired if x not in scheduled[a]]
+			b = (unscheduled or fresh or unpaired)[0]
+			unpaired.remove(b)
+			scheduled[a].add(b)
+			scheduled[b].add(a)
+			if round_index % 2:
+				a, b = b, a
+			pairs.append((a, b))
+		return pairs
+
+	def record(self, seats, result):
+		a, b = [self.standings[x] for x in seats]
+		for standing, latency in zip((a, b), result.latencies):
+			standing.latency.merge(latency)
+		for position_hash in set(result.position_hashes):
+			count = self.position_counts.get(position_hash, 0) + 1
+			self.position_counts[position_hash] = count
+			if count == 2:
+				self.repeated_positions += 1
+		if not result.completed():
+			self.games_aborted += 1
+			return
+		self.games_played += 1
+		score_a, score_b = result.scores
+		for standing, score in ((a, score_a), (b, score_b)):
+			standing.games += 1
+			standing.total_score += score
+		a.opponents.add(seats[1])
+		b.opponents.add(seats[0])
+
+		if result.forfeited is not None:
+			[a, b][result.forfeited].forfeits += 1
+			score_a, score_b = (0, 1) if result.forfeited == 0 else (1, 0)
+		if score_a > score_b:
+			a.wins += 1
+			b.losses += 1
+			result = 1.0
+		elif score_a < score_b:
+			a.losses += 1
+			b.wins += 1
+			result = 0.0
+		else:
+			a.draws += 1
+			b.draws += 1
+			result = 0.5
+		expected = 1.0 / (1.0 + 10.0 ** ((b.rating - a.rating) / 400.0))
+		change = self.elo_k * (result - expected)
+		a.rating += change
+		b.rating -= change
+
+	def print_results(self):
+		print '%-4s %-40s %6s %5s %5s %5s %5s %8s %7s %8s %8s' % ('rank', 'engine',
+			'games', 'wins', 'draws', 'losses', 'time', 'avg', 'rating', 'p50_ms',
+			'p99_ms')
+		ranked = sorted(self.standings, key=lambda x: -x.rating)
+		for rank, standing in enumerate(ranked, 1):
+			average = standing.total_score / float(max(standing.games, 1))
+			print '%-4d %-40s %6d %5d %5d %5d %5d %8.1f %7.1f %8.1f %8.1f' % (rank,
+				standing.engine[:40], standing.games, standing.wins, standing.draws,
+				standing.losses, standing.forfeits, average, standing.rating,
+				standing.latency.percentile(0.5) * 1000,
+				standing.latency.percentile(0.99) * 1000)
+		if self.games_aborted:
+			print '%d games aborted' % self.games_aborted
+		if self.repeated_positions:
+			print '%d positions reached in more than one game' % self.repeated_positions
+
+class EnginePool(object):
+	reset_timeout = 10.0
+	spawn_backoff = 0.1
+	spawn_backoff_limit = 10.0
+	spawn_failure_limit = 5
+
+	def __init__(self, server, model, warm_count, alloc_channel_id):
+		self.server = server
+		self.model = model
+		self.warm_count = warm_count
+		self.alloc_channel_id = alloc_channel_id
+		self.idle = {}
+		self.resetting = []
+		self.busy = {}
+		self.peak_busy = 0
+		self.spawn_count = 0
+		self.reuse_count = 0
+		self.failure_count = 0
+		self.consecutive_failures = {}
+		self.respawn_times = {}
+
+	def spawn(self, command):
+		channel = create_child_process_server_channel(self.alloc_channel_id(),
+			self.model, command)
+		channel.agent.set_name('player%d' % channel.agent.id)
+		self.server.add_channel(channel)
+		self.spawn_count += 1
+		return channel
+
+	def acquire(self, command):
+		idle = self.idle.setdefault(command, [])
+		channel = None
+		while idle and not channel:
+			channel = idle.pop()
+			if channel.id in self.server.channels:
+				self.reuse_count += 1
+			else:
+				self.record_failure(command)
+				channel = None
+		if not channel:
+			channel = self.spawn(command)
+		self.busy[channel.id] = command
+		self.peak_busy = max(self.peak_busy, len(self.busy))
+		return channel
+
+	def release(self, channel):
+		command = self.busy.pop(channel.id)
+		if channel.id not in self.server.channels:
+			self.record_failure(command)
+			return
+		self.consecutive_failures.pop(command, None)
+		if self.warm(command) >= self.warm_count:
+			self.server.remove_channel(channel.id, True)
+		else:
+			channel.agent.ready = False
+			self.server.send_message(channel.agent, ('new_game',))
+			self.resetting.append((channel, command, time.time() + self.reset_timeout))
+
+	def available(self, command, count):
+		spare = (len(self.idle.get(command, ())) +
+			max(0, self.warm_count - self.warm(command)))
+		resetting = len([x for x in self.resetting if x[1] == command])
+		return spare >= count or not resetting
+
+	def warm(self, command):
+		return (len(self.idle.get(command, ())) +
+			len([x for x in self.resetting if x[1] == command]) +
+			len([x for x in self.busy.itervalues() if x == command]))
+
+	def poll(self):
+		now = time.time()
+		for entry in list(self.resetting):
+			channel, command, deadline = entry
+			if channel.id not in self.server.channels:
+				self.resetting.remove(entry)
+				self.record_failure(command)
+			elif channel.agent.ready:
+				self.resetting.remove(entry)
+				self.idle[command].append(channel)
+			elif now > deadline:
+				self.resetting.remove(entry)
+				self.record_failure(command)
+				self.server.remove_channel(channel.id, True)
+		for command, idle in self.idle.iteritems():
+			live = [x for x in idle if x.id in self.server.channels]
+			for i in xrange(len(idle) - len(live)):
+				self.record_failure(command)
+			idle[:] = live
+			if (self.consecutive_failures.get(command, 0) >= self.spawn_failure_limit or
+					now < self.respawn_times.get(command, 0)):
+				continue
+			while self.warm(command) < self.warm_count:
+				idle.append(self.spawn(command))
+
+	def record_failure(self, command):
+		self.failure_count += 1
+		failures = self.consecutive_failures.get(command, 0) + 1
+		self.consecutive_failures[command] = failures
+		self.respawn_times[command] = time.time() + min(self.spawn_backoff_limit,
+			self.spawn_backoff * 2 ** (failures - 1))
+		if failures == self.spawn_failure_limit:
+			print 'engine "%s" failed %d times in a row; no longer keeping it warm' % (
+				command, failures)
+
+	def stats_messages(self):
+		return [('stats_pool', len(self.busy), self.peak_busy,
+			sum(len(x) for x in self.idle.itervalues()), len(self.resetting),
+			self.spawn_count, self.reuse_count, self.failure_count)]
+
+	def summary(self):
+		idle = sum(len(x) for x in self.idle.itervalues())
+		return ('engine pool: %d busy (peak %d), %d idle, %d resetting; '
+			'%d spawned, %d reused, %d failed') % (len(self.busy), self.peak_busy,
+			idle, len(self.resetting), self.spawn_count, self.reuse_count,
+			self.failure_count)
+
+	def close(self):
+		for idle in self.idle.itervalues():
+			for channel in idle:
+				if channel.id in self.server.channels:
+					self.server.remove_channel(channel.id, True)
+		self.idle = {}
+		self.resetting = []
+
+class HostedGamePool(object):
+	def __init__(self, model, listener=None, warm_count=0, max_games=0,
+			send_limit=1 << 20, slow_consumer_policy='snapshot'):
+		self.model = model
+		self.server = EventLoopServer(model, 0, send_limit, slow_consumer_policy)
+		self.listener = listener
+		self.max_games = max_games
+		self.remote_channels = []
+		self.missing_engines = set()
+		self.last_channel_id = 0
+		self.engines = EnginePool(self.server, model, warm_count, self.alloc_channel_id)
+		self.server.stats_sources.append(self.engines)
+		if listener:
+			self.server.add_listener(listener, self.accept)
+
+	def alloc_channel_id(self):
+		self.last_channel_id += 1
+		return self.last_channel_id
+
+	def accept(self, io):
+		channel = create_socket_server_channel(self.alloc_channel_id(), self.model, io)
+		self.server.add_channel(channel)
+		self.remote_channels.append(channel)
+
+	def drop_remote_channels(self):
+		self.remote_channels = [x for x in self.remote_channels
+			if x.id in self.server.channels or x.agent.game]
+
+	def find_remote_channel(self, name, exclude):
+		for channel in self.remote_channels:
+			if (channel.id in self.server.channels and not channel.agent.game and
+					channel.agent.name == name and channel not in exclude):
+				return channel
+		return None
+
+	def start_game(self, engines):
+		needed = {}
+		for engine in engines:
+			if not engine.startswith('@'):
+				needed[engine] = needed.get(engine, 0) + 1
+		for command, count in needed.iteritems():
+			if not self.engines.available(command, count):
+				return None
+		channels = [None] * len(engines)
+		for index, engine in enumerate(engines):
+			if engine.startswith('@'):
+				channel = self.find_remote_channel(engine[1:], channels)
+				if not channel:
+					if engine not in self.missing_engines:
+						self.missing_engines.add(engine)
+						print 'waiting for engine "%s" to connect' % engine[1:]
+					return None
+				channels[index] = channel
+		for index, engine in enumerate(engines):
+			if not channels[index]:
+				channels[index] = self.engines.acquire(engine)
+
+		game = self.model.create_game()
+		for channel in channels:
+			player = game.add_player(channel.agent)
+			channel.agent.set_game(game)
+			channel.agent.add_player_index(player.index)
+		self.model.start_game(game, self.server)
+		self.server.flush()
+		return game, channels
+
+	def release(self, channel):
+		channel.agent.set_game(None)
+		channel.agent.player_indices.clear()
+		if channel not in self.remote_channels:
+			self.engines.release(channel)
+
+	def play(self, tasks):
+		waiting = list(tasks)
+		running = []
+		while waiting or running:
+			for task in list(waiting):
+				if self.max_games and len(running) >= self.max_games:
+					break
+				started = self.start_game(task[1])
+				if started:
+					waiting.remove(task)
+					running.append((task[0],) + started)
+			self.server.run_once()
+			self.engines.poll()
+			self.drop_remote_channels()
+			for entry in list(running):
+				seats, game, channels = entry
+				if game.finished or any(player.agent is None for player in game.players):
+					running.remove(entry)
+					for channel in channels:
+						self.release(channel)
+					self.model.remove_game(game)
+					yield seats, GameResult(game)
+
+	def close(self):
+		self.engines.close()
+		self.server.close_channels()
+		self.server.channels.clear()
+		if self.listener:
+			self.listener.close()
+
+def run_tournament(engines, word_list_path, pairing, game_count, jobs,
+		record_path=None, time_control=None, listen_address=None, warm_count=0,
+		send_limit=1 << 20, slow_consumer_policy='snapshot'):
+	try:
+		word_list = load_word_list(word_list_path)
+	except WordListLoadError, e:
+		print 'unable to load word list from "%s".' % word_list_path
+		return
+	jobs = jobs or multiprocessing.cpu_count()
+	tournament = Tournament(engines, pairing, game_count, record_path, jobs)
+	start_time = time.time()
+	if listen_address or warm_count:
+		listener = None
+		if listen_address:
+			try:
+				listener = ServerChannelListener(listen_address)
+			except (ValueError, socket.error), e:
+				print 'unable to listen on "%s".' % listen_address
+				return
+		def create_game(id):
+			return ScrabbleGame(id, word_list, time_control=time_control)
+		pool = HostedGamePool(GameServerModel(create_game), listener, warm_count,
+			jobs, send_limit, slow_consumer_policy)
+		try:
+			tournament.run(pool.play)
+		finally:
+			engine_summary = pool.engines.summary()
+			pool.close()
+		print engine_summary
+	else:
+		pool = multiprocessing.Pool(jobs,
+			init_tournament_worker, (word_list_path, time_control))
+		try:
+			tournament.run(lambda tasks: pool.imap_unordered(play_tournament_game, tasks))
+		finally:
+			pool.terminate()
+			pool.join()
+	elapsed = time.time() - start_time
+	tournament.print_results()
+	print '%d games in %.1fs (%.1f games/s)' % (tournament.games_played, elapsed,
+		tournament.games_played / max(elapsed, 1e-9))
+
+class GreedyStrategy(object):
+	def __init__(self, generator):
+		self.generator = generator
+
+	def choose_move(self, game, player):
+		best = self.generator.best_move(game.board, player.rack)
+		if not best:
+			return None
+		return best[1]
+
+class RandomStrategy(object):
+	def __init__(self, generator, rng):
+		self.generator = generator
+		self.rng = rng
+
+	def choose_move(self, game, player):
+		moves = self.generator.generate(game.board, player.rack)
+		if not moves:
+			return None
+		return self.rng.choice(moves)[1]
+
+simulation_strategies = {
+	'greedy': lambda generator, rng: GreedyStrategy(generator),
+	'random': RandomStrategy}
+
+def simulate_game(word_list, strategies, seed, rng=None):
+	game = ScrabbleGame(seed, word_list, rng=rng or random.Random(seed))
+	for strategy in strategies:
+		game.add_player(None)
+	game.deal()
+	while not game.is_over():
+		player = game.players[game.to_move]
+		move = strategies[player.index].choose_move(game, player)
+		try:
+			if not move:
+				raise ScrabbleGame.InvalidMove()
+			game.make_move(player, move)
+		except ScrabbleGame.InvalidMove:
+			game.make_pass(player)
+	game.finished = True
+	return game
+
+class ValueHistogram(object):
+	def __init__(self, bucket_width):
+		self.bucket_width = bucket_width
+		self.counts = {}
+		self.count = 0
+		self.total = 0
+		self.total_squares = 0
+
+	def record(self, value):
+		bucket = value // self.bucket_width
+		self.counts[bucket] = self.counts.get(bucket, 0) + 1
+		self.count += 1
+		self.total += value
+		self.total_squares += value * value
+
+	def merge(self, other):
+		for bucket, count in other.counts.iteritems():
+			self.counts[bucket] = self.counts.get(bucket, 0) + count
+		self.count += other.count
+		self.total += other.total
+		self.total_squares += other.total_squares
+
+	def percentile(self, fraction):
+		target = fraction * self.count
+		seen = 0
+		for bucket in sorted(self.counts):
+			seen += self.counts[bucket]
+			if seen >= target:
+				return bucket * self.bucket_width
+		return 0
+
+	def mean(self):
+		return self.total / float(self.count) if self.count else 0.0
+
+	def stdev(self):
+		if not self.count:
+			return 0.0
+		return max(0.0, self.total_squares / float(self.count) - self.mean() ** 2) ** 0.5
+
+	def summary(self):
+		return '%7.1f %6.1f %5d %5d %5d' % (self.mean(), self.stdev(),
+			self.percentile(0.1), self.percentile(0.5), self.percentile(0.9))
+
+class SimulationStats(object):
+	score_bucket_width = 10
+
+	def __init__(self, strategies):
+		self.strategies = strategies
+		self.games = 0
+		self.draws = 0
+		self.wins = [0] * len(strategies)
+		self.moves = [0] * len(strategies)
+		self.bingos = [0] * len(strategies)
+		self.scores = [ValueHistogram(self.score_bucket_width) for x in strategies]
+		self.margins = ValueHistogram(self.score_bucket_width)
+		self.turns = ValueHistogram(1)
+
+	def record(self, game):
+		scores = [player.score for player in game.players]
+		best = max(scores)
+		winners = [index for index, score in enumerate(scores) if score == best]
+		if len(winners) > 1:
+			self.draws += 1
+		else:
+			self.wins[winners[0]] += 1
+		for index, score in enumerate(scores):
+			self.scores[index].record(score)
+		self.margins.record(best - min(scores))
+		self.turns.record(len(game.move_history))
+		for delta in game.move_history:
+			if delta.move:
+				self.moves[delta.player_index] += 1
+				if len(delta.placed) == ScrabbleGame.initial_tiles:
+					self.bingos[delta.player_index] += 1
+		self.games += 1
+
+	def merge(self, other):
+		self.games += other.games
+		self.draws += other.draws
+		for index in xrange(len(self.strategies)):
+			self.wins[index] += other.wins[index]
+			self.moves[index] += other.moves[index]
+			self.bingos[index] += other.bingos[index]
+			self.scores[index].merge(other.scores[index])
+		self.margins.merge(other.margins)
+		self.turns.merge(other.turns)
+
+	def print_results(self):
+		games = max(self.games, 1)
+		print '%-4s %-10s %6s %7s %7s %6s %5s %5s %5s %8s %8s' % ('seat', 'strategy',
+			'wins', 'win%', 'mean', 'stdev', 'p10', 'p50', 'p90', 'bingo/g', 'bingo%')
+		for index, strategy in enumerate(self.strategies):
+			print '%-4d %-10s %6d %7.1f %s %8.3f %8.2f' % (index, strategy,
+				self.wins[index], 100.0 * self.wins[index] / games,
+				self.scores[index].summary(), self.bingos[index] / float(games),
+				100.0 * self.bingos[index] / max(self.moves[index], 1))
+		print '%d games, %d draws' % (self.games, self.draws)
+		print 'turns per game:  mean %.1f, stdev %.1f, p10 %d, p50 %d, p90 %d' % (
+			self.turns.mean(), self.turns.stdev(), self.turns.percentile(0.1),
+			self.turns.percentile(0.5), self.turns.percentile(0.9))
+		print 'winning margin:  mean %.1f, stdev %.1f, p10 %d, p50 %d, p90 %d' % (
+			self.margins.mean(), self.margins.stdev(), self.margins.percentile(0.1),
+			self.margins.percentile(0.5), self.margins.percentile(0.9))
+
+	def print_distribution(self):
+		for index, strategy in enumerate(self.strategies):
+			histogram = self.scores[index]
+			peak = max(histogram.counts.itervalues()) if histogram.counts else 1
+			print 'score distribution for seat %d (%s):' % (index, strategy)
+			for bucket in sorted(histogram.counts):
+				count = histogram.counts[bucket]
+				print '  %4d %7d %s' % (bucket * histogram.bucket_width, count,
+					'#' * max(1, 50 * count // peak))
+
+simulation_worker_state = {}
+def init_simulation_worker(word_list_path):
+	start_worker_profiler()
+	simulation_worker_state['word_list_path'] = word_list_path
+	try:
+		word_list = load_word_list(word_list_path)
+	except WordListLoadError:
+		simulation_worker_state['word_list'] = None
+		return
+	simulation_worker_state['word_list'] = word_list
+	simulation_worker_state['generator'] = MoveGenerator(word_list)
+
+def play_simulation_shard(shard):
+	strategy_names, seeds = shard
+	word_list = simulation_worker_state['word_list']
+	if word_list is None:
+		raise WordListLoadError(simulation_worker_state['word_list_path'])
+	generator = simulation_worker_state['generator']
+	stats = SimulationStats(strategy_names)
+	for seed in seeds:
+		rng = random.Random(seed)
+		strategies = [simulation_strategies[name](generator, rng) for name in strategy_names]
+		stats.record(simulate_game(word_list, strategies, seed, rng))
+	return stats
+
+simulation_shard_size = 10
+simulation_report_interval = 5.0
+def run_simulation(strategy_names, word_list_path, game_count, jobs, seed=0,
+		verbose=False):
+	jobs = jobs or multiprocessing.cpu_count()
+	shard_size = max(1, min(simulation_shard_size, game_count // (jobs * 4)))
+	shards = [(strategy_names, xrange(seed + start, seed + min(start + shard_size, game_count)))
+		for start in xrange(0, game_count, shard_size)]
+	stats = SimulationStats(strategy_names)
+	start_time = time.time()
+	last_report = start_time
+	if jobs == 1:
+		init_simulation_worker(word_list_path)
+		results = itertools.imap(play_simulation_shard, shards)
+		pool = None
+	else:
+		pool = multiprocessing.Pool(jobs, init_simulation_worker, (word_list_path,))
+		results = pool.imap_unordered(play_simulation_shard, shards)
+	try:
+		for shard_stats in results:
+			stats.merge(shard_stats)
+			now = time.time()
+			if now - last_report >= simulation_report_interval and stats.games < game_count:
+				last_report = now
+				print '%d/%d games, %.1f games/s' % (stats.games, game_count,
+					stats.games / (now - start_time))
+				stats.print_results()
+	except WordListLoadError, e:
+		print 'unable to load word list from "%s".' % word_list_path
+		return
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
+	elapsed = time.time() - start_time
+	stats.print_results()
+	if verbose:
+		stats.print_distribution()
+	print '%d games in %.1fs (%.1f games/s)' % (stats.games, elapsed,
+		stats.games / max(elapsed, 1e-9))
+
 class DummyEngine(object):
 	class InputError(Exception): pass
+	def __init__(self, input=None, output=None, framing='lines'):
+		self.input = input or sys.stdin
+		self.output = output or sys.stdout
+		self.framing = framing
+		self.input_framing = 'lines'
+		self.output_framing = 'lines'
+
 	def run(self):
+		if self.framing != 'lines':
+			self.send('framing', self.framing)
+			self.output_framing = self.framing
 		while True:
 			try:
 				for command, args in self.read_commands():
-					pass
+					self.handle_command(command, args)
 				break
 			except DummyEngine.InputError, e:
-				print 'debug "Invalid command syntax received from server: \"%s\""' % e.message.strip()
-				sys.stdout.flush()
-		print ' debug "exitting"'
-		sys.stdout.flush()
+				self.send('debug', 'Invalid command syntax received from server: %s' %
+					e.message.strip())
+		self.send('debug', 'exitting')
+
+	def send(self, *args):
+		try:
+			self.output.write(encode_message(args, self.output_framing))
+			self.output.flush()
+		except (IOError, socket.error):
+			pass
 	
+	def handle_command(self, command, args):
+		if command == 'new_game':
+			self.send('ready')
+
 	def read_commands(self):
 		while True:
-			message = sys.stdin.readline()
-			if not message:
-				break
-			args = None
-			try:
-				args = explode_args(message)
-			except ExplodeError:
-				raise self.InputError(message)
+			if self.input_framing == 'lines':
+				message = self.input.readline()
+				if not message:
+					break
+				args = None
+				try:
+					args = explode_args(message)
+				except ExplodeError:
+					raise self.InputError(message)
+			else:
+				args = read_frame(self.input)
+				if args is None:
+					break
 
 			if args:
 				command, args = args[0], args[1:]
+				if command == 'framing' and args:
+					self.input_framing = args[0]
+					continue
 				yield command, args
 
+class GeneratorEngine(DummyEngine):
+	def __init__(self, word_list_path=None, input=None, output=None, generator=None,
+			framing='lines'):
+		DummyEngine.__init__(self, input, output, framing)
+		self.word_list_path = word_list_path
+		self.generator = generator
+		self.downloaded_words = []
+		self.player_index = -1
+		self.reset()
+
+	def reset(self):
+		self.board = None
+		self.tiles = {}
+		self.rack = TileCounts()
+		self.version = 0
+
+	def run(self):
+		if self.word_list_path and not self.generator:
+			try:
+				self.generator = MoveGenerator(load_word_list(self.word_list_path))
+			except WordListLoadError:
+				self.send('debug', 'unable to load word list, downloading it instead')
+		DummyEngine.run(self)
+
+	def handle_command(self, command, args):
+		if command == 'start_game':
+			self.reset()
+			if not self.generator and not self.downloaded_words:
+				self.send('get_word_list', 'zlib')
+		elif command == 'new_game':
+			self.reset()
+			self.player_index = -1
+			self.send('ready')
+		elif command == 'player_index':
+			self.player_index = int(args[0])
+		elif command == 'word_count':
+			self.downloaded_words = []
+		elif command == 'word':
+			self.downloaded_words.append(args[1])
+		elif command == 'words':
+			self.downloaded_words.extend(args[1].split())
+		elif command == 'word_list_zlib':
+			self.downloaded_words = zlib.decompress(base64.b64decode(args[0])).split('\n')
+		elif command == 'word_list_file':
+			self.generator = MoveGenerator(load_word_list(args[0]))
+		elif command == 'to_move':
+			if int(args[0]) == self.player_index:
+				self.send('get_state')
+		elif command == 'state':
+			self.handle_state(args)
+		elif command in ('passed', 'game_over') and args:
+			self.advance_version(int(args[-1]))
+		elif command == 'move_made':
+			player_index, position, word = args[:3]
+			if len(args) > 4:
+				self.advance_version(int(args[4]))
+			move = parse_move(position, word)
+			row, col = move.start
+			dir_x, dir_y = ScrabbleGame.direction_steps[move.direction]
+			placed = []
+			for i, letter in enumerate(move.letters):
+				position = (row + dir_y * i, col + dir_x * i)
+				if position not in self.tiles:
+					self.tiles[position] = letter
+					placed.append(position + (letter,))
+			if self.board:
+				self.board.place(placed)
+		elif command == 'error' and args and args[0] == 'move_invalid':
+			self.send('pass')
+
+	def advance_version(self, version):
+		if version == self.version + 1:
+			self.version = version
+
+	def handle_state(self, args):
+		version, to_move, bag_size, finished = [int(x) for x in args[:4]]
+		cells = args[4]
+		if version != self.version:
+			columns = ScrabbleBoard.num_cols
+			self.tiles = dict(((index // columns, index % columns), letter)
+				for index, letter in enumerate(cells) if letter != '_')
+			self.board = None
+			self.version = version
+		rack = args[6 + int(args[5]):]
+		if rack[:1] == ['rack'] and int(rack[1]) == self.player_index:
+			self.rack = TileCounts(rack[2])
+			if to_move == self.player_index and not finished:
+				self.play()
+
+	def play(self):
+		if not self.generator:
+			self.generator = MoveGenerator(Lexicon.from_words(self.downloaded_words))
+			self.downloaded_words = []
+		if not self.board:
+			self.board = ScrabbleBoard(self.generator.lexicon, ScrabbleGame.letter_scores)
+			self.board.place([position + (letter,)
+				for position, letter in self.tiles.iteritems()])
+		best = self.generator.best_move(self.board, self.rack)
+		if best:
+			score, move = best
+			self.send('move', *move.fields())
+		else:
+			self.send('pass')
+
+def run_socket_engines(word_list_path, address, name, connections, framing='lines'):
+	generator = None
+	if word_list_path:
+		try:
+			generator = MoveGenerator(load_word_list(word_list_path))
+		except WordListLoadError:
+			print 'unable to load word list from "%s", downloading it instead.' % word_list_path
+	threads = []
+	for i in xrange(connections):
+		try:
+			sock = connect_socket(address)
+		except (ValueError, socket.error), e:
+			print 'unable to connect to "%s": %s' % (address, e)
+			break
+		engine = GeneratorEngine(None, sock.makefile('r'), sock.makefile('w'), generator,
+			framing)
+		engine.send('set_name', name)
+		thread = threading.Thread(target=engine.run)
+		thread.setDaemon(True)
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		while thread.isAlive():
+			thread.join(1.0)
+
 def main(argv):
 
 	options = None
 	try:
 		options = parse_command_line(argv)
-	except OptionArgumentMissingError, e:
+	except (OptionArgumentMissingError, OptionArgumentInvalidError), e:
 		print e.message
 
+	profiler = None
+	if options and options.profile_path:
+		profiler = SamplingProfiler(options.profile_path)
+		profiler.start()
+		profiler_state['profiler'] = profiler
+	try:
+		execute(argv, options)
+	finally:
+		if profiler:
+			profiler.stop()
+
+def execute(argv, options):
 	args_error = None
 	if options:
-		if options.execute_mode == AppOptions.execute_game:
+		if options.slow_consumer_policy not in Server.slow_consumer_policies:
+			args_error = 'slow consumer policy must be one of: %s.' % ', '.join(
+				Server.slow_consumer_policies)
+		elif options.execute_mode == AppOptions.execute_game:
 			if len(options.child_engines) < 2:
 				args_error = 'at least 2 engines must be specified on command line using --engine.'
+			elif options.listen_address and not options.event_loop:
+				args_error = 'accepting connections with --listen requires --event-loop.'
 			elif not options.word_list_path:
 				args_error = 'a file containing the list of valid words must be specified using --words.'
 			else:
-				run_game(argv, options.child_engines, options.word_list_path)
+				observer = None
+				if options.log_path:
+					try:
+						observer = FileGameObserver(options.log_path)
+					except IOError, e:
+						args_error = 'unable to open log file "%s": %s.' % (options.log_path,
+							e.strerror)
+				elif options.quiet:
+					observer = NullGameObserver()
+				else:
+					observer = ConsoleGameObserver()
+				if observer:
+					run_game(argv, options.child_engines, options.word_list_path,
+						options.event_loop, options.queue_limit, observer,
+						options.record_path, options.time_control, options.listen_address,
+						options.send_limit, options.slow_consumer_policy)
 					
+		elif options.execute_mode == AppOptions.execute_tournament:
+			if len(options.child_engines) < 2:
+				args_error = 'at least 2 engines must be specified on command line using --engine.'
+			elif not options.word_list_path:
+				args_error = 'a file containing the list of valid words must be specified using --words.'
+			elif options.pairing not in Tournament.pairings:
+				args_error = 'pairing must be one of: %s.' % ', '.join(Tournament.pairings)
+			elif (not options.listen_address and
+					[x for x in options.child_engines if x.startswith('@')]):
+				args_error = 'connected engines (@name) require an address to be specified using --listen.'
+			else:
+				run_tournament(options.child_engines, options.word_list_path,
+					options.pairing, options.game_count, options.jobs,
+					options.record_path, options.time_control, options.listen_address,
+					options.warm_count, options.send_limit, options.slow_consumer_policy)
+		elif options.execute_mode == AppOptions.execute_replay:
+			if not options.record_path:
+				args_error = 'a file containing game records must be specified using --record.'
+			elif not options.word_list_path:
+				args_error = 'a file containing the list of valid words must be specified using --words.'
+			else:
+				run_replay(options.record_path, options.word_list_path, options.verbose)
+		elif options.execute_mode == AppOptions.execute_compile_words:
+			if not options.word_list_path:
+				args_error = 'a file containing the list of valid words must be specified using --words.'
+			elif not options.output_path:
+				args_error = 'an output file must be specified using --output.'
+			else:
+				compile_word_list(options.word_list_path, options.output_path)
+		elif options.execute_mode == AppOptions.execute_simulate:
+			strategies = options.strategies or ['greedy', 'greedy']
+			unknown = [x for x in strategies if x not in simulation_strategies]
+			if not options.word_list_path:
+				args_error = 'a file containing the list of valid words must be specified using --words.'
+			elif len(strategies) < 2:
+				args_error = 'at least 2 strategies must be specified using --strategy.'
+			elif unknown:
+				args_error = 'strategy must be one of: %s.' % ', '.join(
+					sorted(simulation_strategies))
+			else:
+				run_simulation(strategies, options.word_list_path, options.game_count,
+					options.jobs, options.seed, options.verbose)
+		elif options.framing not in framing_modes:
+			args_error = 'framing must be one of: %s.' % ', '.join(framing_modes)
 		elif options.execute_mode == AppOptions.execute_dummy_engine:
-			DummyEngine().run()
+			DummyEngine(framing=options.framing).run()
+		elif options.execute_mode == AppOptions.execute_engine:
+			if options.connect_address:
+				if not agent_name_re.match(options.engine_name):
+					args_error = 'engine names may only contain letters, digits and underscores.'
+				else:
+					run_socket_engines(options.word_list_path, options.connect_address,
+						options.engine_name, options.connections, options.framing)
+			else:
+				GeneratorEngine(options.word_list_path, framing=options.framing).run()
 		else:
 			args_error = ''
 	else:
@@ -838,9 +4049,37 @@ def main(argv):
 		print '    where <command> is one of:'
 		print '     * server'
 		print '     * dummy-engine'
+		print '     * engine'
+		print '     * tournament'
+		print '     * replay'
+		print '     * compile_words'
+		print '     * simulate'
 		print '    and options can include:'
 		print '     * -e|--engine <path>'
 		print '     * -w|--words <path>'
+		print '     * --event-loop'
+		print '     * -q|--quiet'
+		print '     * --log <path>'
+		print '     * -r|--record <path>'
+		print '     * -v|--verbose'
+		print '     * -t|--time <seconds>'
+		print '     * --increment <seconds>'
+		print '     * --queue-limit <count>'
+		print '     * -p|--pairing round_robin|swiss'
+		print '     * -n|--games <count>'
+		print '     * -j|--jobs <count>'
+		print '     * -o|--output <path>'
+		print '     * --listen [<host>:]<port>|unix:<path>'
+		print '     * --connect [<host>:]<port>|unix:<path>'
+		print '     * --name <name>'
+		print '     * --connections <count>'
+		print '     * --warm <count>'
+		print '     * --framing lines|length'
+		print '     * --send-limit <bytes>'
+		print '     * --slow-consumers snapshot|kick'
+		print '     * -s|--strategy greedy|random'
+		print '     * --seed <number>'
+		print '     * --profile <path>'
 
 if __name__ == '__main__':
 	main(sys.argv)
@@ -0,0 +1,695 @@
+#!/usr/bin/python
+
+import random
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+import StringIO
+
+import rabble
+
+reference_arg_re = re.compile(r'"(?:.*\\")*.*"|[a-zA-Z0-9_]+')
+def reference_explode_args(string):
+	args = []
+	while True:
+		string = string.lstrip()
+		if not string:
+			return args
+		m = reference_arg_re.match(string)
+		if not m:
+			raise rabble.ExplodeError()
+		args.append(string[m.start():m.end()].strip('"'))
+		string = string[m.end():]
+
+test_words = ('aa ab ad ae ag ah ai al am an ar as at aw ax ay ba be bi bo by de do ed '
+	'ef eh el em en er es et ex fa go ha he hi ho id if in is it jo ka la li lo ma me '
+	'mi mo mu my na ne no nu od oe of oh om on op or os ow ox oy pa pe pi re sh si so '
+	'ta ti to uh um un up us ut we wo xi xu ya ye yo act arts art ate cat cats den '
+	'dog east eat eats end god ire its net nod note notes ones onset ore rat rate '
+	'rates rats rest rite roe sat sate seat set site sit star stare stone tar tars '
+	'tea tear tears teas ten tie tier ties tire toe tone tones aster irate retain '
+	'satire stain train trains quiz jinx zoo oxen').split()
+
+class FakeServer(object):
+	def __init__(self):
+		self.messages = []
+
+	def send_message(self, agent, message):
+		self.messages.append((agent, message))
+
+	def broadcast(self, agents, message):
+		for agent in agents:
+			self.send_message(agent, message)
+
+	def received(self, agent):
+		return [message for target, message in self.messages if target is agent]
+
+class ExplodeArgsTest(unittest.TestCase):
+	def test_words(self):
+		self.assertEqual(rabble.explode_args('  move 8h cat  '), ['move', '8h', 'cat'])
+		self.assertEqual(rabble.explode_args(''), [])
+
+	def test_quoted_argument(self):
+		self.assertEqual(rabble.explode_args('rack 0 "abc _de"'), ['rack', '0', 'abc _de'])
+		self.assertEqual(rabble.explode_args('words 0 ""'), ['words', '0', ''])
+
+	def test_invalid_syntax(self):
+		self.assertRaises(rabble.ExplodeError, rabble.explode_args, 'move 8h c-t')
+		self.assertRaises(rabble.ExplodeError, rabble.explode_args, '"unterminated')
+
+	def test_round_trip(self):
+		for args in (['state', '3', '0', '86', '0'], ['rack', '1', 'ab cd'],
+				['word_list_file', '/tmp/words.dawg'], ['set_name', 'alpha_2']):
+			message = ' '.join(args[:-1] + ['"%s"' % args[-1]])
+			self.assertEqual(rabble.explode_args(message), args)
+
+	def test_matches_reference(self):
+		rng = random.Random(21)
+		alphabet = 'ab_9 "\\\n\t-'
+		for i in xrange(5000):
+			string = ''.join(rng.choice(alphabet) for j in xrange(rng.randint(0, 12)))
+			try:
+				expected = reference_explode_args(string)
+			except rabble.ExplodeError:
+				self.assertRaises(rabble.ExplodeError, rabble.explode_args, string)
+			else:
+				self.assertEqual(rabble.explode_args(string), expected, repr(string))
+
+class FramingTest(unittest.TestCase):
+	messages = [('to_move', 1), ('rack', 0, 'ab cd'), ('move_made', 0, '8h', 'cat', 10, 4),
+		('words', 0, ''), ('final_score', 1, -4), ('word_list_file', '/tmp/a b'), ()]
+
+	def test_round_trip(self):
+		stream = StringIO.StringIO(''.join(rabble.encode_frame(x) for x in self.messages))
+		for message in self.messages:
+			self.assertEqual(rabble.read_frame(stream), [str(x) for x in message])
+		self.assertEqual(rabble.read_frame(stream), None)
+
+	def test_lines_round_trip(self):
+		for message in self.messages:
+			line = rabble.encode_line(message)
+			self.assertEqual(rabble.explode_args(line), [str(x) for x in message])
+		self.assertEqual(rabble.encode_line(('move_made', 0, '8h', 'cat', 10, 4)),
+			'move_made 0 8h cat 10 4\n')
+		self.assertEqual(rabble.encode_line(('rack', 0, 'ab cd')), 'rack 0 "ab cd"\n')
+
+	def test_arguments_are_not_reparsed(self):
+		frame = rabble.encode_frame(('error', '(bad) "x"'))
+		self.assertEqual(rabble.read_frame(StringIO.StringIO(frame)), ['error', '(bad) "x"'])
+
+	def test_truncated_frame(self):
+		frame = rabble.encode_frame(('passed', 1, 7))
+		for length in xrange(len(frame)):
+			self.assertEqual(rabble.read_frame(StringIO.StringIO(frame[:length])), None)
+
+	def test_decode_frame(self):
+		self.assertEqual(rabble.decode_frame(''), [])
+		self.assertEqual(rabble.decode_frame('a\0b c'), ['a', 'b c'])
+
+	def test_encoded_message_is_shared(self):
+		message = rabble.EncodedMessage(('to_move', 0))
+		self.assertEqual(message.encode('lines'), 'to_move 0\n')
+		self.assertTrue(message.encode('length') is message.encode('length'))
+
+class CommandLineTest(unittest.TestCase):
+	def test_numeric_options(self):
+		options = rabble.parse_command_line(['rabble.py', 'tournament', '-n', '12', '-j', '3',
+			'-t', '1.5', '--increment', '0.25', '--send-limit', '4096'])
+		self.assertEqual((options.game_count, options.jobs), (12, 3))
+		self.assertEqual(options.time_control, (1.5, 0.25))
+		self.assertEqual(options.send_limit, 4096)
+
+	def test_invalid_numeric_argument(self):
+		for option in ('--queue-limit', '-n', '-j', '--connections', '--warm',
+				'--send-limit', '-t', '--increment', '--seed'):
+			self.assertRaises(rabble.OptionArgumentInvalidError, rabble.parse_command_line,
+				['rabble.py', 'game', option, 'abc'])
+
+	def test_missing_argument(self):
+		self.assertRaises(rabble.OptionArgumentMissingError, rabble.parse_command_line,
+			['rabble.py', 'game', '--queue-limit'])
+
+	def test_unwritable_log(self):
+		argv = ['rabble.py', 'game', '-e', 'a', '-e', 'b', '-w', 'words.txt', '--log',
+			'/nonexistent/rabble.log']
+		output = StringIO.StringIO()
+		stdout, sys.stdout = sys.stdout, output
+		try:
+			rabble.execute(argv, rabble.parse_command_line(argv))
+		finally:
+			sys.stdout = stdout
+		self.assertTrue('unable to open log file "/nonexistent/rabble.log"' in
+			output.getvalue())
+
+class GameTestCase(unittest.TestCase):
+	def setUp(self):
+		self.lexicon = rabble.Lexicon.from_words(test_words)
+		self.generator = rabble.MoveGenerator(self.lexicon)
+
+	def create_game(self, seed=0, time_control=None):
+		game = rabble.ScrabbleGame(0, self.lexicon, time_control=time_control,
+			rng=random.Random(seed))
+		for i in xrange(2):
+			game.add_player(None)
+		return game
+
+	def snapshot(self, game):
+		board = game.board
+		empty = [i for i, cell in enumerate(board.cells) if not cell]
+		return (str(board.cells), board.hash, board.tile_count, str(board.anchors),
+			[[board.cross_masks[x][i] for i in empty] for x in sorted(board.cross_masks)],
+			[[board.cross_scores[x][i] for i in empty] for x in sorted(board.cross_scores)],
+			str(game.pool), game.to_move,
+			[(x.rack.tiles(), x.rack.hash, x.score) for x in game.players])
+
+	def recomputed(self, board):
+		fresh = rabble.ScrabbleBoard(self.lexicon, board.letter_scores)
+		fresh.cells[:] = board.cells
+		fresh.tile_count = board.tile_count
+		for row in xrange(fresh.num_rows):
+			for col in xrange(fresh.num_cols):
+				fresh.update_cell(row, col)
+		return fresh
+
+	def assertCrossChecksCurrent(self, board):
+		fresh = self.recomputed(board)
+		self.assertEqual(str(board.anchors), str(fresh.anchors))
+		empty = [i for i, cell in enumerate(board.cells) if not cell]
+		for direction in board.cross_masks:
+			self.assertEqual([board.cross_masks[direction][i] for i in empty],
+				[fresh.cross_masks[direction][i] for i in empty])
+			self.assertEqual([board.cross_scores[direction][i] for i in empty],
+				[fresh.cross_scores[direction][i] for i in empty])
+
+	def play_greedy(self, game, turns):
+		moves = 0
+		for turn in xrange(turns):
+			if game.is_over():
+				break
+			player = game.players[game.to_move]
+			best = self.generator.best_move(game.board, player.rack)
+			if best:
+				game.make_move(player, best[1])
+				moves += 1
+			else:
+				game.make_pass(player)
+			yield game
+		self.assertTrue(moves >= 3)
+
+class MoveTest(GameTestCase):
+	def test_make_and_undo_move(self):
+		game = self.create_game()
+		game.deal()
+		player = game.players[0]
+		player.rack = rabble.TileCounts('catsxyz')
+		before = self.snapshot(game)
+		version = game.version
+		delta = game.make_move(player, rabble.parse_move('8g', 'cats'))
+		self.assertEqual(delta.score, 6)
+		self.assertEqual(delta.words, ['cats'])
+		self.assertEqual(game.board.get(7, 6), 'c')
+		self.assertEqual(player.score, 6)
+		self.assertEqual(len(player.rack), 7)
+		self.assertEqual(game.to_move, 1)
+		game.undo_move()
+		self.assertEqual(self.snapshot(game), before)
+		self.assertEqual(game.version, version + 2)
+
+	def test_invalid_move_leaves_state(self):
+		game = self.create_game()
+		game.deal()
+		player = game.players[0]
+		player.rack = rabble.TileCounts('catsxyz')
+		before = self.snapshot(game)
+		for position, letters in (('1a', 'cat'), ('8h', 'tca'), ('8h', 'zoo')):
+			self.assertRaises(rabble.ScrabbleGame.InvalidMove, game.make_move, player,
+				rabble.parse_move(position, letters))
+			self.assertEqual(self.snapshot(game), before)
+
+	def test_undo_whole_game(self):
+		game = self.create_game(seed=3)
+		game.deal()
+		snapshots = [self.snapshot(game)]
+		for state in self.play_greedy(game, 30):
+			snapshots.append(self.snapshot(game))
+		snapshots.pop()
+		while game.move_history:
+			game.undo_move()
+			self.assertEqual(self.snapshot(game), snapshots.pop())
+
+class CrossCheckTest(GameTestCase):
+	def test_incremental_matches_recompute(self):
+		for seed in xrange(3):
+			game = self.create_game(seed)
+			game.deal()
+			for state in self.play_greedy(game, 30):
+				self.assertCrossChecksCurrent(game.board)
+			while game.move_history:
+				game.undo_move()
+				self.assertCrossChecksCurrent(game.board)
+
+	def test_place_and_remove(self):
+		board = rabble.ScrabbleBoard(self.lexicon, rabble.ScrabbleGame.letter_scores)
+		tiles = [(7, 7, 's'), (7, 8, 'e'), (7, 9, 't')]
+		board.place(tiles)
+		self.assertCrossChecksCurrent(board)
+		self.assertTrue(board.allows(rabble.ScrabbleMove.horizontal, 6, 8, 'r'))
+		self.assertFalse(board.allows(rabble.ScrabbleMove.horizontal, 6, 8, 'q'))
+		self.assertTrue(board.allows(rabble.ScrabbleMove.vertical, 6, 8, 'q'))
+		board.remove(tiles)
+		self.assertCrossChecksCurrent(board)
+		self.assertEqual(board.hash, 0)
+
+class CompiledLexiconTest(GameTestCase):
+	def setUp(self):
+		GameTestCase.setUp(self)
+		self.directory = tempfile.mkdtemp()
+		self.text_path = os.path.join(self.directory, 'words.txt')
+		self.compiled_path = os.path.join(self.directory, 'words.dawg')
+		f = open(self.text_path, 'w')
+		f.write('\n'.join(test_words + ['Proper', 'don\'t', '']))
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def compile(self):
+		stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+		try:
+			rabble.compile_word_list(self.text_path, self.compiled_path)
+		finally:
+			sys.stdout = stdout
+		return rabble.load_word_list(self.compiled_path)
+
+	def test_matches_word_list(self):
+		compiled = self.compile()
+		self.assertTrue(isinstance(compiled, rabble.MappedLexicon))
+		self.assertEqual(compiled.path, self.compiled_path)
+		self.assertEqual(len(compiled), len(self.lexicon))
+		self.assertEqual(list(compiled), list(self.lexicon))
+		self.assertEqual(compiled.node_count(), self.lexicon.node_count())
+		for word in ('cats', 'cat', 'ca', 'xyz', 'proper', 'stones'):
+			self.assertEqual(word in compiled, word in self.lexicon)
+			self.assertEqual(compiled.has_prefix(word), self.lexicon.has_prefix(word))
+
+	def test_same_moves(self):
+		compiled = self.compile()
+		games = [rabble.ScrabbleGame(0, x, rng=random.Random(4)) for x in (self.lexicon, compiled)]
+		for game in games:
+			game.add_player(None)
+			game.add_player(None)
+			game.deal()
+		generators = [rabble.MoveGenerator(x) for x in (self.lexicon, compiled)]
+		for turn in xrange(20):
+			moves = [generator.best_move(game.board, game.players[game.to_move].rack)
+				for generator, game in zip(generators, games)]
+			summaries = [x and (x[0], str(x[1])) for x in moves]
+			self.assertEqual(summaries[0], summaries[1])
+			for game, best in zip(games, moves):
+				player = game.players[game.to_move]
+				if best:
+					game.make_move(player, best[1])
+				else:
+					game.make_pass(player)
+		self.assertTrue(games[0].board.tile_count > 0)
+		self.assertEqual(games[0].board.hash, games[1].board.hash)
+
+	def test_corrupt_file(self):
+		self.compile()
+		data = open(self.compiled_path, 'rb').read()
+		for corrupt in (data[:-1], data[:len(rabble.Lexicon.file_magic) + 4]):
+			f = open(self.compiled_path, 'wb')
+			f.write(corrupt)
+			f.close()
+			self.assertRaises(rabble.WordListLoadError, rabble.load_word_list,
+				self.compiled_path)
+
+class ListenerTest(GameTestCase):
+	def setUp(self):
+		GameTestCase.setUp(self)
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'rabble.sock')
+		self.address = 'unix:' + self.path
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_refuses_to_replace_file(self):
+		f = open(self.path, 'w')
+		f.write('data')
+		f.close()
+		self.assertRaises(socket.error, rabble.ServerChannelListener, self.address)
+		self.assertEqual(open(self.path).read(), 'data')
+
+	def test_replaces_stale_socket(self):
+		stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		stale.bind(self.path)
+		stale.close()
+		listener = rabble.ServerChannelListener(self.address)
+		try:
+			client = rabble.connect_socket(self.address)
+			client.close()
+		finally:
+			listener.close()
+		self.assertFalse(os.path.exists(self.path))
+
+	def test_drops_disconnected_channels(self):
+		listener = rabble.ServerChannelListener(self.address)
+		pool = rabble.HostedGamePool(rabble.GameServerModel(
+			lambda id: rabble.ScrabbleGame(id, self.lexicon)), listener)
+		stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+		try:
+			clients = [rabble.connect_socket(self.address) for i in xrange(2)]
+			deadline = time.time() + 5
+			while len(pool.remote_channels) < 2 and time.time() < deadline:
+				pool.server.run_once()
+			self.assertEqual(len(pool.remote_channels), 2)
+			clients.pop().close()
+			while len(pool.server.channels) > 1 and time.time() < deadline:
+				pool.server.run_once()
+			pool.drop_remote_channels()
+			self.assertEqual([x.id for x in pool.remote_channels], pool.server.channels.keys())
+			clients.pop().close()
+		finally:
+			pool.close()
+			sys.stdout = stdout
+		self.assertFalse(os.path.exists(self.path))
+
+class SlowConsumerTest(GameTestCase):
+	def start_game(self, policy):
+		model = rabble.GameServerModel(lambda id: rabble.ScrabbleGame(id, self.lexicon))
+		self.server = rabble.EventLoopServer(model, 0, 64, policy)
+		self.game = model.create_game()
+		self.clients = []
+		for id in xrange(2):
+			server_socket, client = socket.socketpair()
+			client.settimeout(5)
+			self.clients.append(client)
+			channel = rabble.create_socket_server_channel(id, model,
+				rabble.SocketServerChannelIO(server_socket))
+			self.server.add_channel(channel)
+			channel.agent.set_game(self.game)
+		player, watcher = [x.agent for x in self.server.channels.itervalues()]
+		self.game.add_player(player)
+		player.add_player_index(0)
+		self.game.add_player(None)
+		self.game.add_watcher(watcher)
+		self.game.deal()
+		self.watcher = watcher
+
+	def tearDown(self):
+		for client in self.clients:
+			client.close()
+		for channel in self.server.channels.values():
+			channel.close(True)
+
+	def receive(self, client):
+		data = ''
+		while not data.endswith('\n'):
+			chunk = client.recv(65536)
+			if not chunk:
+				break
+			data += chunk
+		return data.splitlines()
+
+	def overflow(self):
+		stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+		try:
+			for i in xrange(20):
+				self.game.broadcast(self.server, ('to_move', 0))
+			self.server.flush()
+		finally:
+			sys.stdout = stdout
+
+	def test_player_is_not_limited(self):
+		self.start_game('kick')
+		self.overflow()
+		lines = []
+		while len(lines) < 20:
+			lines.extend(self.receive(self.clients[0]))
+		self.assertEqual(lines, ['to_move 0'] * 20)
+
+	def test_watcher_gets_snapshot(self):
+		self.start_game('snapshot')
+		self.overflow()
+		args = [rabble.explode_args(x) for x in self.receive(self.clients[1])]
+		self.assertEqual(len(args), 1)
+		self.assertEqual(args[0][:3], ['state', str(self.game.version), '0'])
+		self.assertTrue(self.watcher.channel_id in self.server.channels)
+
+	def test_watcher_is_kicked(self):
+		self.start_game('kick')
+		self.overflow()
+		self.assertFalse(self.watcher.channel_id in self.server.channels)
+		self.assertFalse(self.watcher in self.game.agents)
+		self.assertEqual(self.receive(self.clients[1]), [])
+
+class SimulationTest(GameTestCase):
+	def setUp(self):
+		GameTestCase.setUp(self)
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'words.txt')
+		f = open(self.path, 'w')
+		f.write('\n'.join(test_words))
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def simulate(self, seed, names=('greedy', 'random')):
+		rng = random.Random(seed)
+		strategies = [rabble.simulation_strategies[x](self.generator, rng) for x in names]
+		game = rabble.simulate_game(self.lexicon, strategies, seed, rng)
+		return [(x.player_index, str(x.move)) for x in game.move_history], game
+
+	def test_deterministic(self):
+		for seed in xrange(3):
+			first, game = self.simulate(seed)
+			second, game = self.simulate(seed)
+			self.assertEqual(first, second)
+			self.assertTrue(game.finished and game.is_over())
+		self.assertNotEqual(self.simulate(0)[0], self.simulate(1)[0])
+
+	def test_merge(self):
+		names = ['greedy', 'random']
+		games = [self.simulate(seed)[1] for seed in xrange(6)]
+		whole = rabble.SimulationStats(names)
+		for game in games:
+			whole.record(game)
+		merged = rabble.SimulationStats(names)
+		for shard in (games[:1], games[1:4], games[4:], []):
+			stats = rabble.SimulationStats(names)
+			for game in shard:
+				stats.record(game)
+			merged.merge(stats)
+		for attribute in ('games', 'draws', 'wins', 'moves', 'bingos'):
+			self.assertEqual(getattr(merged, attribute), getattr(whole, attribute))
+		for a, b in zip(merged.scores + [merged.margins, merged.turns],
+				whole.scores + [whole.margins, whole.turns]):
+			self.assertEqual((a.counts, a.count, a.total, a.total_squares),
+				(b.counts, b.count, b.total, b.total_squares))
+
+	def test_shard_matches_simulate_game(self):
+		rabble.init_simulation_worker(self.path)
+		stats = rabble.play_simulation_shard((['greedy', 'random'], xrange(2)))
+		self.assertEqual(stats.games, 2)
+		self.assertEqual(stats.scores[0].total,
+			sum(self.simulate(seed)[1].players[0].score for seed in xrange(2)))
+
+	def test_missing_word_list(self):
+		for jobs in (1, 2):
+			output = StringIO.StringIO()
+			stdout, sys.stdout = sys.stdout, output
+			try:
+				rabble.run_simulation(['greedy', 'greedy'], '/nonexistent/words.txt', 4, jobs)
+			finally:
+				sys.stdout = stdout
+			self.assertEqual(output.getvalue(),
+				'unable to load word list from "/nonexistent/words.txt".\n')
+
+class StatsCommandTest(unittest.TestCase):
+	def setUp(self):
+		self.model = rabble.GameServerModel(None)
+		self.server = rabble.EventLoopServer(self.model)
+		self.clients = []
+		for id, admin in enumerate((False, True)):
+			server_socket, client = socket.socketpair()
+			client.settimeout(5)
+			self.clients.append(client)
+			agent = self.model.create_agent(id, rabble.GameServerAgentPrivileges(admin))
+			self.server.add_channel(rabble.ServerChannel(id,
+				rabble.SocketServerChannelIO(server_socket), agent))
+
+	def tearDown(self):
+		for client in self.clients:
+			client.close()
+		for channel in self.server.channels.values():
+			channel.close(True)
+
+	def request_stats(self, id):
+		channel = self.server.channels[id]
+		channel.agent.handle_message('stats', [], self.model, self.server)
+		self.server.flush()
+		f = self.clients[id].makefile('r')
+		lines = [f.readline()]
+		if lines[0].startswith('stats_count '):
+			lines.extend(f.readline() for i in xrange(int(lines[0].split()[1])))
+		return [rabble.explode_args(x) for x in lines]
+
+	def test_denied_without_admin(self):
+		self.assertEqual(self.request_stats(0), [['error', 'permission_denied', 'stats']])
+
+	def test_admin_gets_stats(self):
+		messages = self.request_stats(1)
+		self.assertEqual(messages[0], ['stats_count', str(len(messages) - 1)])
+		self.assertEqual([x[0] for x in messages[1:]],
+			['stats_server', 'stats_channel', 'stats_channel'])
+		self.assertEqual([x[1] for x in messages[2:]], ['0', '1'])
+
+class GameRecordTest(GameTestCase):
+	def play_recorded_game(self, seed):
+		game = self.create_game(seed)
+		game.deal()
+		for state in self.play_greedy(game, 40):
+			pass
+		game.finished = True
+		return game
+
+	def test_round_trip(self):
+		game = self.play_recorded_game(10)
+		text = rabble.GameRecord.from_game(game).format()
+		records = list(rabble.read_game_records(StringIO.StringIO(text * 2)))
+		self.assertEqual(len(records), 2)
+		record = records[0]
+		self.assertEqual(record.names, ['player0', 'player1'])
+		self.assertEqual(record.bag, game.initial_bag)
+		self.assertEqual(len(record.turns), len(game.move_history))
+		self.assertEqual(record.final_scores, [x.score for x in game.players])
+		self.assertEqual(record.board_hash, game.board.hash)
+		self.assertEqual(record.format(), text)
+
+	def test_replay(self):
+		game = self.play_recorded_game(11)
+		record = rabble.GameRecord.from_game(game)
+		replayed, mismatches = rabble.replay_game_record(record, self.lexicon)
+		self.assertEqual(mismatches, 0)
+		self.assertEqual([x.score for x in replayed.players], record.final_scores)
+		self.assertEqual(replayed.board.hash, record.board_hash)
+
+		turns = [x for x in record.turns if x[1]]
+		player_index, position, word, score = turns[0]
+		record.turns[record.turns.index(turns[0])] = (player_index, position, word, score + 1)
+		replayed, mismatches = rabble.replay_game_record(record, self.lexicon)
+		self.assertEqual(mismatches, 1)
+
+	def test_rejected_move(self):
+		game = self.play_recorded_game(13)
+		record = rabble.GameRecord.from_game(game)
+		record.turns[0] = (0, '1a', 'zzz', 30)
+		self.assertRaises(rabble.GameRecordError, rabble.replay_game_record, record,
+			self.lexicon)
+
+	def test_malformed_records(self):
+		for text in ('bag abc\n', 'game 999 2\n', 'game 1 2\nm 0 8h\n', 'game 1 2\nx 1\n'):
+			self.assertRaises(rabble.GameRecordError, list,
+				rabble.read_game_records(StringIO.StringIO(text)))
+
+	def test_missing_word_list(self):
+		output = StringIO.StringIO()
+		stdout, sys.stdout = sys.stdout, output
+		try:
+			rabble.run_replay('records.txt', '/nonexistent/words.txt')
+		finally:
+			sys.stdout = stdout
+		self.assertEqual(output.getvalue(),
+			'unable to load word list from "/nonexistent/words.txt".\n')
+
+class ClockTest(GameTestCase):
+	def test_charge(self):
+		clock = rabble.GameClock(1.0, 0.5)
+		clock.charge(0.25)
+		self.assertEqual(clock.remaining, 1.25)
+		self.assertFalse(clock.expired(1.0))
+		self.assertTrue(clock.expired(1.25))
+		clock.charge(2.0)
+		self.assertEqual(clock.remaining, 0)
+
+	def start_game(self, time_control):
+		game = self.create_game(time_control=time_control)
+		self.server = FakeServer()
+		self.agents = []
+		for player in game.players:
+			agent = rabble.GameServerAgent(player.index, player.index,
+				rabble.GameServerAgentPrivileges(False))
+			agent.add_player_index(player.index)
+			agent.set_name('player%d' % player.index)
+			agent.set_game(game)
+			player.agent = agent
+			game.agents.add(agent)
+			self.agents.append(agent)
+		game.start(self.server)
+		return game
+
+	def assertClocksValid(self):
+		for agent, message in self.server.messages:
+			if message[0] == 'clock':
+				self.assertTrue(message[2] >= 0, message)
+
+	def test_move_in_time(self):
+		game = self.start_game((10.0, 0.0))
+		game.handle_message('pass', [], self.agents[0], self.server)
+		self.assertEqual(game.forfeited, None)
+		self.assertEqual(game.to_move, 1)
+		self.assertTrue(0 < game.players[0].clock.remaining <= 10.0)
+
+	def test_late_pass_forfeits(self):
+		game = self.start_game((1.0, 5.0))
+		game.turn_started -= 2.0
+		game.handle_message('pass', [], self.agents[0], self.server)
+		self.assertEqual(game.forfeited, 0)
+		self.assertTrue(game.finished)
+		self.assertEqual(game.players[0].clock.remaining, 0)
+		self.assertEqual(game.move_history, [])
+		self.assertTrue(('time_forfeit', 0) in self.server.received(self.agents[1]))
+		self.assertClocksValid()
+
+	def test_late_move_forfeits(self):
+		game = self.start_game((1.0, 0.0))
+		player = game.players[0]
+		best = self.generator.best_move(game.board, player.rack)
+		move = best and best[1] or rabble.parse_move('8h', 'at')
+		game.turn_started -= 2.0
+		game.handle_message('move', str(move).split(), self.agents[0], self.server)
+		self.assertEqual(game.forfeited, 0)
+		self.assertEqual(player.score, 0)
+		self.assertTrue(game.board.is_empty())
+		self.assertClocksValid()
+
+	def test_tick_forfeits(self):
+		game = self.start_game((1.0, 0.0))
+		game.handle_tick(self.server)
+		self.assertEqual(game.forfeited, None)
+		game.turn_started -= 2.0
+		game.handle_tick(self.server)
+		self.assertEqual(game.forfeited, 0)
+		self.assertClocksValid()
+
+	def test_latency_counts_accepted_turns(self):
+		game = self.start_game(None)
+		player = game.players[0]
+		invalid = rabble.parse_move('1a', 'zzz')
+		game.handle_message('move', str(invalid).split(), self.agents[0], self.server)
+		self.assertTrue(('error', 'move_invalid') in self.server.received(self.agents[0]))
+		game.handle_message('pass', [], self.agents[1], self.server)
+		self.assertEqual(player.latency.count, 0)
+		game.handle_message('pass', [], self.agents[0], self.server)
+		self.assertEqual(player.latency.count, 1)
+		self.assertEqual(game.players[1].latency.count, 0)
+
+if __name__ == '__main__':
+	unittest.main()